@@ -2,19 +2,87 @@ from __future__ import annotations
 
 import json
 import os
+import re
 import sqlite3
 import threading
 import fnmatch
 import base64
 import hashlib
 import secrets
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import lru_cache
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+
+# (unix second, its ISO string): timestamps have second resolution, so most calls reuse the last one.
+_now_iso: Tuple[int, str] = (0, "")
 
 
 def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    global _now_iso
+    now = int(time.time())
+    cached = _now_iso
+    if cached[0] == now:
+        return cached[1]
+    text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now))
+    _now_iso = (now, text)
+    return text
+
+
+SESSION_TOKEN_BYTES = 32
+SESSION_TOKEN_BATCH = 64
+
+_session_tokens: Deque[str] = deque()
+_session_tokens_lock = threading.Lock()
+
+
+def _new_session_token() -> str:
+    # Same format as secrets.token_urlsafe(32), but one entropy read per batch.
+    with _session_tokens_lock:
+        if not _session_tokens:
+            raw = secrets.token_bytes(SESSION_TOKEN_BYTES * SESSION_TOKEN_BATCH)
+            for i in range(0, len(raw), SESSION_TOKEN_BYTES):
+                chunk = raw[i : i + SESSION_TOKEN_BYTES]
+                _session_tokens.append(base64.urlsafe_b64encode(chunk).rstrip(b"=").decode("ascii"))
+        return _session_tokens.popleft()
+
+
+if hasattr(os, "register_at_fork"):
+    # never hand out the same pre-generated token in two processes
+    os.register_at_fork(after_in_child=_session_tokens.clear)
+
+
+def _padded_len(n: int, cap: int) -> int:
+    """n rounded up to a power of two (at most cap), for the length of an IN (...) list.
+
+    sqlite3 keeps prepared statements per SQL text; padding the list (by repeating the last
+    value, which does not change an IN result) keeps the number of distinct texts small so
+    they stay in that cache instead of pushing the fixed statements out.
+    """
+    size = 1
+    while size < n:
+        size *= 2
+    return min(size, cap)
+
+
+def _payload_json(payload: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Stored form of an event/snapshot payload; the common None and {} cases skip the encoder."""
+    if payload is None:
+        return None
+    if not payload:
+        return "{}"
+    return json.dumps(payload, ensure_ascii=False)
+
+
+@lru_cache(maxsize=1024)
+def _globs_pattern(globs: Tuple[str, ...]) -> "re.Pattern[str]":
+    # one alternation per distinct glob list: a single match instead of one fnmatch per glob
+    return re.compile("|".join(fnmatch.translate(g) for g in globs))
 
 
 def _ensure_parent_dir(path: str) -> None:
@@ -23,6 +91,61 @@ def _ensure_parent_dir(path: str) -> None:
         os.makedirs(parent, exist_ok=True)
 
 
+# The devices columns every device query returns (get_device, list_devices, list_status and
+# _upsert_device_by_key), so the dicts they build have the same keys.
+_DEVICE_COLUMNS = (
+    "id",
+    "cluster_id",
+    "device_key",
+    "vendor",
+    "model",
+    "line_no",
+    "ip",
+    "port",
+    "protocol",
+    "path",
+    "auth_type",
+    "auth_token",
+    "enabled",
+    "last_state",
+    "last_state_at",
+    "created_at",
+    "updated_at",
+)
+_DEVICE_COLUMNS_SQL = ", ".join(_DEVICE_COLUMNS)
+# Likewise for the snapshot, baseline and controlled-file rule getters.
+_SNAPSHOT_COLUMNS = (
+    "id",
+    "device_id",
+    "observed_at",
+    "success",
+    "http_status",
+    "latency_ms",
+    "error",
+    "protocol_version",
+    "main_version",
+    "firmware_version",
+    "payload_json",
+    "etag",
+    "payload_hash",
+)
+_SNAPSHOT_COLUMNS_SQL = ", ".join(_SNAPSHOT_COLUMNS)
+_BASELINE_COLUMNS = (
+    "id",
+    "cluster_id",
+    "vendor",
+    "model",
+    "expected_main_version",
+    "allowed_main_globs_json",
+    "note",
+    "effective_from",
+    "created_at",
+)
+_BASELINE_COLUMNS_SQL = ", ".join(_BASELINE_COLUMNS)
+_RULE_COLUMNS = ("id", "cluster_id", "vendor", "model", "paths_json", "mode", "max_bytes", "note", "created_at")
+_RULE_COLUMNS_SQL = ", ".join(_RULE_COLUMNS)
+
+
 @dataclass(frozen=True)
 class DeviceAuth:
     type: str  # none | bearer | x-device-token
@@ -34,12 +157,43 @@ class Database:
         self.db_path = db_path
         self._lock = threading.RLock()
         _ensure_parent_dir(db_path)
-        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Every statement text below is prepared once and reused from the connection's statement
+        # cache; the default 128 entries is less than the number of distinct statements in this file.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=512)
         self._conn.row_factory = sqlite3.Row
+        # Rows written to users/sessions; excluded from data_version().
+        self._auth_changes = 0
+        # cluster id -> row. Clusters are never updated or deleted, so a row once read stays valid
+        # (even with other processes on the same file); misses are not cached.
+        self._cluster_cache: Dict[int, Dict[str, Any]] = {}
         with self._conn:
             self._conn.execute("PRAGMA foreign_keys = ON;")
+            # Every poll commits a snapshot (plus events); in WAL mode with synchronous=NORMAL those
+            # commits append to the log without an fsync each, and readers never block the writer.
+            self._conn.execute("PRAGMA journal_mode = WAL;")
+            self._conn.execute("PRAGMA synchronous = NORMAL;")
         self._init_schema()
 
+    def data_version(self) -> Tuple[int, int]:
+        """Changes whenever non-auth data (devices, snapshots, events, ...) is written.
+
+        The second part is SQLite's PRAGMA data_version, which moves on commits made by other
+        connections, e.g. another server process sharing the database file.
+        """
+        with self._lock:
+            external = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            return self._conn.total_changes - self._auth_changes, int(external)
+
+    @contextmanager
+    def _auth_write(self) -> Iterator[None]:
+        with self._lock:
+            before = self._conn.total_changes
+            try:
+                with self._conn:
+                    yield
+            finally:
+                self._auth_changes += self._conn.total_changes - before
+
     def close(self) -> None:
         with self._lock:
             self._conn.close()
@@ -197,6 +351,7 @@ class Database:
 
                 CREATE INDEX IF NOT EXISTS idx_events_created_at ON events(created_at DESC);
                 CREATE INDEX IF NOT EXISTS idx_events_device_created_at ON events(device_id, created_at DESC);
+                CREATE INDEX IF NOT EXISTS idx_events_device_type_created_at ON events(device_id, event_type, created_at DESC);
 
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -247,6 +402,12 @@ class Database:
             self._conn.execute("ALTER TABLE version_catalog ADD COLUMN device_checksum TEXT;")
         if not has_column("version_catalog", "device_updated_at"):
             self._conn.execute("ALTER TABLE version_catalog ADD COLUMN device_updated_at TEXT;")
+        if not has_column("device_snapshots", "etag"):
+            self._conn.execute("ALTER TABLE device_snapshots ADD COLUMN etag TEXT;")
+        if not has_column("controlled_file_observations", "content_zlib"):
+            self._conn.execute("ALTER TABLE controlled_file_observations ADD COLUMN content_zlib BLOB;")
+        if not has_column("device_snapshots", "payload_hash"):
+            self._conn.execute("ALTER TABLE device_snapshots ADD COLUMN payload_hash TEXT;")
 
     def has_any_user(self) -> bool:
         rows = self._query("SELECT 1 AS x FROM users LIMIT 1")
@@ -264,19 +425,20 @@ class Database:
             raise ValueError("missing_password")
         salt = secrets.token_bytes(16)
         pwd_hash = self._hash_password(password, salt=salt)
-        return self._execute(
-            """
-            INSERT INTO users(username, role, password_salt_b64, password_hash_b64, created_at)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                username,
-                role,
-                base64.b64encode(salt).decode("ascii"),
-                base64.b64encode(pwd_hash).decode("ascii"),
-                _utc_now_iso(),
-            ),
-        )
+        with self._auth_write():
+            return self._execute(
+                """
+                INSERT INTO users(username, role, password_salt_b64, password_hash_b64, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    username,
+                    role,
+                    base64.b64encode(salt).decode("ascii"),
+                    base64.b64encode(pwd_hash).decode("ascii"),
+                    _utc_now_iso(),
+                ),
+            )
 
     def verify_user(self, *, username: str, password: str) -> Optional[Dict[str, Any]]:
         rows = self._query(
@@ -308,7 +470,7 @@ class Database:
         user_id = int(rows[0]["id"])
         salt = secrets.token_bytes(16)
         pwd_hash = self._hash_password(str(new_password), salt=salt)
-        with self._lock, self._conn:
+        with self._auth_write():
             self._conn.execute(
                 "UPDATE users SET password_salt_b64 = ?, password_hash_b64 = ? WHERE id = ?",
                 (
@@ -322,22 +484,23 @@ class Database:
         return True
 
     def create_session(self, *, user_id: int, ttl_seconds: int = 12 * 3600) -> str:
-        token = secrets.token_urlsafe(32)
+        token = _new_session_token()
         now = _utc_now_iso()
         # store expires_at as ISO; keep comparison logic in python (simple)
         expires_at = datetime.now(timezone.utc).timestamp() + int(ttl_seconds)
         expires_iso = datetime.fromtimestamp(expires_at, tz=timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
-        self._execute(
-            """
-            INSERT INTO sessions(token, user_id, created_at, expires_at, last_seen_at)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (token, int(user_id), now, expires_iso, now),
-        )
+        with self._auth_write():
+            self._execute(
+                """
+                INSERT INTO sessions(token, user_id, created_at, expires_at, last_seen_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (token, int(user_id), now, expires_iso, now),
+            )
         return token
 
     def delete_session(self, *, token: str) -> None:
-        with self._lock, self._conn:
+        with self._auth_write():
             self._conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
 
     def get_session_user(self, *, token: str) -> Optional[Dict[str, Any]]:
@@ -363,7 +526,7 @@ class Database:
         except Exception:
             return None
         # touch
-        with self._lock, self._conn:
+        with self._auth_write():
             self._conn.execute("UPDATE sessions SET last_seen_at = ? WHERE token = ?", (_utc_now_iso(), token))
         return {"user_id": int(r["user_id"]), "username": r["username"], "role": r["role"]}
 
@@ -384,11 +547,19 @@ class Database:
         )
 
     def get_cluster(self, cluster_id: int) -> Optional[Dict[str, Any]]:
+        hit = self._cluster_cache.get(cluster_id)
+        if hit is not None:
+            return dict(hit)
         rows = self._query(
             "SELECT id, name, description, created_at FROM clusters WHERE id = ?",
             (cluster_id,),
         )
-        return dict(rows[0]) if rows else None
+        if not rows:
+            return None
+        row = dict(rows[0])
+        if len(self._cluster_cache) < 4096:
+            self._cluster_cache[cluster_id] = row
+        return dict(row)
 
     def get_cluster_by_name(self, name: str) -> Optional[Dict[str, Any]]:
         rows = self._query(
@@ -468,37 +639,97 @@ class Database:
         path: str,
         auth: DeviceAuth,
         enabled: bool = True,
-    ) -> Tuple[int, str]:
-        existing = self.get_device_by_key(device_key)
-        if existing:
-            self.update_device(
-                int(existing["id"]),
+    ) -> Tuple[int, str, Dict[str, Any]]:
+        """Create or update the device with this key; returns (id, "created"|"updated", device row)."""
+        with self._lock, self._conn:
+            return self._upsert_device_by_key(
                 cluster_id=cluster_id,
+                device_key=device_key,
                 vendor=vendor,
                 model=model,
                 line_no=line_no,
                 ip=ip,
-                port=int(port),
+                port=port,
                 protocol=protocol,
                 path=path,
                 auth=auth,
                 enabled=enabled,
             )
-            return int(existing["id"]), "updated"
-        device_id = self.create_device(
-            cluster_id=cluster_id,
-            device_key=device_key,
-            vendor=vendor,
-            model=model,
-            line_no=line_no,
-            ip=ip,
-            port=int(port),
-            protocol=protocol,
-            path=path,
-            auth=auth,
-            enabled=enabled,
-        )
-        return int(device_id), "created"
+
+    def _upsert_device_by_key(
+        self,
+        *,
+        cluster_id: int,
+        device_key: str,
+        vendor: str,
+        model: str,
+        line_no: Optional[str] = None,
+        ip: str,
+        port: int,
+        protocol: str,
+        path: str,
+        auth: DeviceAuth,
+        enabled: bool = True,
+    ) -> Tuple[int, str, Dict[str, Any]]:
+        # caller holds self._lock and the transaction
+        now = _utc_now_iso()
+        hit = self._conn.execute("SELECT id FROM devices WHERE device_key = ?", (device_key,)).fetchone()
+        if hit is not None:
+            device_id = int(hit["id"])
+            action = "updated"
+            self._conn.execute(
+                """
+                UPDATE devices SET
+                    cluster_id = ?, vendor = ?, model = ?, line_no = COALESCE(?, line_no), ip = ?, port = ?,
+                    protocol = ?, path = ?, auth_type = ?, auth_token = ?, enabled = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (
+                    cluster_id,
+                    vendor,
+                    model,
+                    line_no,
+                    ip,
+                    int(port),
+                    protocol,
+                    path,
+                    auth.type,
+                    auth.token,
+                    1 if enabled else 0,
+                    now,
+                    device_id,
+                ),
+            )
+        else:
+            action = "created"
+            cur = self._conn.execute(
+                """
+                INSERT INTO devices(
+                    cluster_id, device_key, vendor, model, line_no, ip, port,
+                    protocol, path, auth_type, auth_token, enabled, created_at, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    cluster_id,
+                    device_key,
+                    vendor,
+                    model,
+                    line_no,
+                    ip,
+                    int(port),
+                    protocol,
+                    path,
+                    auth.type,
+                    auth.token,
+                    1 if enabled else 0,
+                    now,
+                    now,
+                ),
+            )
+            device_id = int(cur.lastrowid)
+        # Read back in the same transaction rather than with RETURNING, which needs SQLite 3.35.
+        row = self._conn.execute(f"SELECT {_DEVICE_COLUMNS_SQL} FROM devices WHERE id = ?", (device_id,)).fetchone()
+        return device_id, action, dict(row)
 
     def update_device(
         self,
@@ -554,9 +785,8 @@ class Database:
 
     def get_device(self, device_id: int) -> Optional[Dict[str, Any]]:
         rows = self._query(
-            """
-            SELECT id, cluster_id, device_key, vendor, model, line_no, ip, port, protocol, path,
-                   auth_type, auth_token, enabled, last_state, last_state_at, created_at, updated_at
+            f"""
+            SELECT {_DEVICE_COLUMNS_SQL}
             FROM devices
             WHERE id = ?
             """,
@@ -564,6 +794,53 @@ class Database:
         )
         return dict(rows[0]) if rows else None
 
+    # (alias, columns) of get_device_detail_bundle: the same columns as get_device /
+    # get_latest_snapshot / get_baseline / get_controlled_file_rule.
+    _BUNDLE_COLUMNS = (
+        ("d", _DEVICE_COLUMNS),
+        ("s", _SNAPSHOT_COLUMNS),
+        ("b", _BASELINE_COLUMNS),
+        ("r", _RULE_COLUMNS),
+    )
+
+    def get_device_detail_bundle(self, device_id: int) -> Optional[Dict[str, Optional[Dict[str, Any]]]]:
+        """Device, latest snapshot, baseline and controlled-file rule in one query.
+
+        Returns {"device", "latest_snapshot", "baseline", "controlled_file_rule"}, each shaped like
+        the corresponding single getter, or None when the device does not exist.
+        """
+        select = ", ".join(f"{alias}.{col} AS {alias}_{col}" for alias, cols in self._BUNDLE_COLUMNS for col in cols)
+        rows = self._query(
+            f"""
+            SELECT {select}
+            FROM devices d
+            LEFT JOIN device_snapshots s ON s.id = (
+                SELECT id FROM device_snapshots WHERE device_id = d.id ORDER BY observed_at DESC, id DESC LIMIT 1
+            )
+            LEFT JOIN baselines b ON b.cluster_id = d.cluster_id AND b.vendor = d.vendor AND b.model = d.model
+            LEFT JOIN controlled_file_rules r ON r.cluster_id = d.cluster_id AND r.vendor = d.vendor AND r.model = d.model
+            WHERE d.id = ?
+            """,
+            (device_id,),
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        parts: Dict[str, Optional[Dict[str, Any]]] = {}
+        for alias, cols in self._BUNDLE_COLUMNS:
+            if row[f"{alias}_id"] is None:
+                parts[alias] = None
+            else:
+                parts[alias] = {c: row[f"{alias}_{c}"] for c in cols}
+        snap = self._snapshot_dict(parts["s"]) if parts["s"] is not None else None
+        base = parts["b"]
+        if base is not None:
+            base["allowed_main_globs"] = self._parse_globs(base.get("allowed_main_globs_json"))
+        rule = parts["r"]
+        if rule is not None:
+            rule["paths"] = self._parse_globs(rule.get("paths_json"))
+        return {"device": parts["d"], "latest_snapshot": snap, "baseline": base, "controlled_file_rule": rule}
+
     def list_devices(self, *, cluster_id: Optional[int] = None, enabled_only: bool = False) -> List[Dict[str, Any]]:
         wheres: List[str] = []
         params: List[Any] = []
@@ -575,8 +852,7 @@ class Database:
         where_sql = f"WHERE {' AND '.join(wheres)}" if wheres else ""
         rows = self._query(
             f"""
-            SELECT id, cluster_id, device_key, vendor, model, line_no, ip, port, protocol, path,
-                   auth_type, auth_token, enabled, last_state, last_state_at, created_at, updated_at
+            SELECT {_DEVICE_COLUMNS_SQL}
             FROM devices
             {where_sql}
             ORDER BY id ASC
@@ -625,7 +901,7 @@ class Database:
         where_sql = f"WHERE {' AND '.join(wheres)}" if wheres else ""
         rows = self._query(
             f"""
-            SELECT id, cluster_id, vendor, model, expected_main_version, allowed_main_globs_json, note, effective_from, created_at
+            SELECT {_BASELINE_COLUMNS_SQL}
             FROM baselines
             {where_sql}
             ORDER BY id ASC
@@ -641,8 +917,8 @@ class Database:
 
     def get_baseline(self, *, cluster_id: int, vendor: str, model: str) -> Optional[Dict[str, Any]]:
         rows = self._query(
-            """
-            SELECT id, cluster_id, vendor, model, expected_main_version, allowed_main_globs_json, note, effective_from, created_at
+            f"""
+            SELECT {_BASELINE_COLUMNS_SQL}
             FROM baselines
             WHERE cluster_id = ? AND vendor = ? AND model = ?
             """,
@@ -715,7 +991,7 @@ class Database:
         where_sql = f"WHERE {' AND '.join(wheres)}" if wheres else ""
         rows = self._query(
             f"""
-            SELECT id, cluster_id, vendor, model, paths_json, mode, max_bytes, note, created_at
+            SELECT {_RULE_COLUMNS_SQL}
             FROM controlled_file_rules
             {where_sql}
             ORDER BY id ASC
@@ -731,8 +1007,8 @@ class Database:
 
     def get_controlled_file_rule(self, *, cluster_id: int, vendor: str, model: str) -> Optional[Dict[str, Any]]:
         rows = self._query(
-            """
-            SELECT id, cluster_id, vendor, model, paths_json, mode, max_bytes, note, created_at
+            f"""
+            SELECT {_RULE_COLUMNS_SQL}
             FROM controlled_file_rules
             WHERE cluster_id = ? AND vendor = ? AND model = ?
             LIMIT 1
@@ -764,13 +1040,22 @@ class Database:
         source: str,
     ) -> None:
         now = _utc_now_iso()
+        # Content is kept as zlib-compressed bytes rather than base64 text (config text shrinks
+        # several-fold); rows written before this keep their content_b64.
+        content_zlib: Optional[bytes] = None
+        if content_b64 is not None:
+            try:
+                content_zlib = zlib.compress(base64.b64decode(content_b64, validate=False))
+                content_b64 = None
+            except Exception:
+                content_zlib = None
         with self._lock, self._conn:
             self._conn.execute(
                 """
                 INSERT OR IGNORE INTO controlled_file_observations(
                     device_id, path, fingerprint, snapshot_id,
-                    content_b64, encoding, content_type, truncated, source, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    content_b64, content_zlib, encoding, content_type, truncated, source, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     int(device_id),
@@ -778,6 +1063,7 @@ class Database:
                     str(fingerprint),
                     int(snapshot_id) if snapshot_id is not None else None,
                     content_b64,
+                    content_zlib,
                     encoding,
                     content_type,
                     1 if truncated else 0,
@@ -791,7 +1077,7 @@ class Database:
     ) -> Optional[Dict[str, Any]]:
         rows = self._query(
             """
-            SELECT id, device_id, path, fingerprint, snapshot_id, content_b64, encoding, content_type, truncated, source, created_at
+            SELECT id, device_id, path, fingerprint, snapshot_id, content_b64, content_zlib, encoding, content_type, truncated, source, created_at
             FROM controlled_file_observations
             WHERE device_id = ? AND path = ? AND fingerprint = ?
             ORDER BY id DESC
@@ -799,7 +1085,46 @@ class Database:
             """,
             (int(device_id), str(path), str(fingerprint)),
         )
-        return dict(rows[0]) if rows else None
+        return self._observation_row(rows[0]) if rows else None
+
+    @staticmethod
+    def _observation_row(r: sqlite3.Row) -> Dict[str, Any]:
+        """Row dict with "content" (raw bytes, when stored compressed) and content_b64 always filled in."""
+        d = dict(r)
+        blob = d.pop("content_zlib", None)
+        d["content"] = None
+        if blob is not None:
+            try:
+                raw = zlib.decompress(blob)
+            except zlib.error:
+                return d
+            d["content"] = raw
+            d["content_b64"] = base64.b64encode(raw).decode("ascii")
+        return d
+
+    def get_controlled_file_observations_bulk(
+        self, *, device_id: int, keys: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Observations for many (path, fingerprint) pairs of one device, in one query per 400 pairs."""
+        out: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        uniq = list(dict.fromkeys((str(p), str(fp)) for p, fp in keys))
+        for i in range(0, len(uniq), 400):
+            chunk = uniq[i : i + 400]
+            chunk += chunk[-1:] * (_padded_len(len(chunk), 400) - len(chunk))
+            params: List[Any] = [int(device_id)]
+            for p, fp in chunk:
+                params.extend((p, fp))
+            rows = self._query(
+                f"""
+                SELECT id, device_id, path, fingerprint, snapshot_id, content_b64, content_zlib, encoding, content_type, truncated, source, created_at
+                FROM controlled_file_observations
+                WHERE device_id = ? AND (path, fingerprint) IN (VALUES {", ".join(["(?, ?)"] * len(chunk))})
+                """,
+                tuple(params),
+            )
+            for r in rows:
+                out[(str(r["path"]), str(r["fingerprint"]))] = self._observation_row(r)
+        return out
 
     @staticmethod
     def _parse_globs(raw: Any) -> List[str]:
@@ -819,11 +1144,10 @@ class Database:
         expected = str(baseline.get("expected_main_version") or "")
         if observed_main == expected:
             return True
-        globs = baseline.get("allowed_main_globs") or []
-        for g in globs:
-            if fnmatch.fnmatchcase(observed_main, str(g)):
-                return True
-        return False
+        globs = baseline.get("allowed_main_globs")
+        if not globs:
+            return False
+        return _globs_pattern(tuple(str(g) for g in globs)).match(observed_main) is not None
 
     def update_device_state(self, device_id: int, state: str) -> None:
         now = _utc_now_iso()
@@ -1021,6 +1345,65 @@ class Database:
             out.append(d)
         return out
 
+    def record_discovered_devices(
+        self, found: List[Tuple[Dict[str, Any], Dict[str, Any]]]
+    ) -> List[Tuple[int, str]]:
+        """upsert_device_by_key + record_snapshot for each (device kwargs, snapshot kwargs) pair.
+
+        All pairs are written in one transaction (one commit for a whole discover batch instead
+        of two per device); returns (device id, "created"|"updated") for each pair, in order.
+        """
+        out: List[Tuple[int, str]] = []
+        snapshot_rows: List[Tuple[Any, ...]] = []
+        with self._lock, self._conn:
+            for device, snapshot in found:
+                device_id, action, _ = self._upsert_device_by_key(**device)
+                out.append((device_id, action))
+                snapshot_rows.append(self._snapshot_params(device_id=device_id, **snapshot))
+            self._conn.executemany(self._INSERT_SNAPSHOT_SQL, snapshot_rows)
+        return out
+
+    _INSERT_SNAPSHOT_SQL = """
+        INSERT INTO device_snapshots(
+            device_id, observed_at, success, http_status, latency_ms, error,
+            protocol_version, main_version, firmware_version, payload_json, etag, payload_hash
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+    @staticmethod
+    def _snapshot_params(
+        *,
+        device_id: int,
+        success: bool,
+        http_status: Optional[int],
+        latency_ms: Optional[int],
+        error: Optional[str],
+        protocol_version: Optional[int],
+        main_version: Optional[str],
+        firmware_version: Optional[str],
+        payload: Optional[Dict[str, Any]],
+        observed_at: Optional[str] = None,
+        etag: Optional[str] = None,
+        payload_hash: Optional[str] = None,
+        payload_json: Optional[str] = None,
+    ) -> Tuple[Any, ...]:
+        if payload_json is None:
+            payload_json = _payload_json(payload)
+        return (
+            device_id,
+            observed_at or _utc_now_iso(),
+            1 if success else 0,
+            http_status,
+            latency_ms,
+            error,
+            protocol_version,
+            main_version,
+            firmware_version,
+            payload_json,
+            etag,
+            payload_hash,
+        )
+
     def record_snapshot(
         self,
         *,
@@ -1034,33 +1417,34 @@ class Database:
         firmware_version: Optional[str],
         payload: Optional[Dict[str, Any]],
         observed_at: Optional[str] = None,
+        etag: Optional[str] = None,
+        payload_hash: Optional[str] = None,
+        payload_json: Optional[str] = None,
     ) -> int:
+        """payload_json, when given, is the already-serialized payload (e.g. copied from an identical snapshot)."""
         return self._execute(
-            """
-            INSERT INTO device_snapshots(
-                device_id, observed_at, success, http_status, latency_ms, error,
-                protocol_version, main_version, firmware_version, payload_json
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                device_id,
-                observed_at or _utc_now_iso(),
-                1 if success else 0,
-                http_status,
-                latency_ms,
-                error,
-                protocol_version,
-                main_version,
-                firmware_version,
-                json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+            self._INSERT_SNAPSHOT_SQL,
+            self._snapshot_params(
+                device_id=device_id,
+                success=success,
+                http_status=http_status,
+                latency_ms=latency_ms,
+                error=error,
+                protocol_version=protocol_version,
+                main_version=main_version,
+                firmware_version=firmware_version,
+                payload=payload,
+                observed_at=observed_at,
+                etag=etag,
+                payload_hash=payload_hash,
+                payload_json=payload_json,
             ),
         )
 
     def get_latest_snapshot(self, device_id: int) -> Optional[Dict[str, Any]]:
         rows = self._query(
-            """
-            SELECT id, device_id, observed_at, success, http_status, latency_ms, error,
-                   protocol_version, main_version, firmware_version, payload_json
+            f"""
+            SELECT {_SNAPSHOT_COLUMNS_SQL}
             FROM device_snapshots
             WHERE device_id = ?
             ORDER BY observed_at DESC, id DESC
@@ -1070,7 +1454,11 @@ class Database:
         )
         if not rows:
             return None
-        d = dict(rows[0])
+        return self._snapshot_dict(rows[0])
+
+    @staticmethod
+    def _snapshot_dict(row: Union[sqlite3.Row, Dict[str, Any]]) -> Dict[str, Any]:
+        d = dict(row)
         if d.get("payload_json"):
             try:
                 d["payload"] = json.loads(d["payload_json"])
@@ -1082,9 +1470,8 @@ class Database:
 
     def get_latest_success_snapshot(self, device_id: int) -> Optional[Dict[str, Any]]:
         rows = self._query(
-            """
-            SELECT id, device_id, observed_at, success, http_status, latency_ms, error,
-                   protocol_version, main_version, firmware_version, payload_json
+            f"""
+            SELECT {_SNAPSHOT_COLUMNS_SQL}
             FROM device_snapshots
             WHERE device_id = ? AND success = 1
             ORDER BY observed_at DESC, id DESC
@@ -1172,13 +1559,45 @@ class Database:
         return out
 
     def list_status(self) -> List[Dict[str, Any]]:
-        devices = self.list_devices()
-        out: List[Dict[str, Any]] = []
-        for dev in devices:
-            snap = self.get_latest_snapshot(int(dev["id"]))
-            baseline = self.get_baseline(
-                cluster_id=int(dev["cluster_id"]), vendor=str(dev["vendor"]), model=str(dev["model"])
+        # One pass over devices with their baseline and the ids of the rows the state depends on,
+        # then one query per table for those rows (instead of four queries per device).
+        rows = self._query(
+            f"""
+            SELECT {", ".join("d." + c for c in _DEVICE_COLUMNS)},
+                   {", ".join(f"b.{c} AS b_{c}" for c in _BASELINE_COLUMNS)},
+                   (SELECT s.id FROM device_snapshots s WHERE s.device_id = d.id
+                    ORDER BY s.observed_at DESC, s.id DESC LIMIT 1) AS snap_id,
+                   (SELECT e.id FROM events e WHERE e.device_id = d.id AND e.event_type = 'controlled_files_change'
+                    ORDER BY e.created_at DESC, e.id DESC LIMIT 1) AS change_id,
+                   (SELECT e.id FROM events e WHERE e.device_id = d.id AND e.event_type = 'controlled_files_ack'
+                    ORDER BY e.created_at DESC, e.id DESC LIMIT 1) AS ack_id
+            FROM devices d
+            LEFT JOIN baselines b ON b.cluster_id = d.cluster_id AND b.vendor = d.vendor AND b.model = d.model
+            ORDER BY d.id ASC
+            """
+        )
+        snapshots = {
+            int(r["id"]): self._snapshot_dict(r)
+            for r in self._rows_by_id(
+                f"SELECT {_SNAPSHOT_COLUMNS_SQL} FROM device_snapshots",
+                [r["snap_id"] for r in rows if r["snap_id"] is not None],
             )
+        }
+        event_rows = {
+            int(r["id"]): dict(r)
+            for r in self._rows_by_id(
+                "SELECT id, created_at, message, payload_json FROM events",
+                [i for r in rows for i in (r["change_id"], r["ack_id"]) if i is not None],
+            )
+        }
+        out: List[Dict[str, Any]] = []
+        for r in rows:
+            dev = {c: r[c] for c in _DEVICE_COLUMNS}
+            baseline = None
+            if r["b_id"] is not None:
+                baseline = {c: r[f"b_{c}"] for c in _BASELINE_COLUMNS}
+                baseline["allowed_main_globs"] = self._parse_globs(baseline.get("allowed_main_globs_json"))
+            snap = snapshots.get(int(r["snap_id"])) if r["snap_id"] is not None else None
             state = "unknown"
             if snap is None:
                 state = "never_polled"
@@ -1194,34 +1613,14 @@ class Database:
             # If baseline is ok, show "files_changed" when there is an un-acked change event.
             if state == "ok":
                 try:
-                    last_change = self._query(
-                        """
-                        SELECT id, created_at, message, payload_json
-                        FROM events
-                        WHERE device_id = ? AND event_type = 'controlled_files_change'
-                        ORDER BY created_at DESC, id DESC
-                        LIMIT 1
-                        """,
-                        (int(dev["id"]),),
-                    )
-                    last_ack = self._query(
-                        """
-                        SELECT id, payload_json
-                        FROM events
-                        WHERE device_id = ? AND event_type = 'controlled_files_ack'
-                        ORDER BY created_at DESC, id DESC
-                        LIMIT 1
-                        """,
-                        (int(dev["id"]),),
-                    )
-                    if last_change:
-                        change = dict(last_change[0])
+                    change = event_rows.get(int(r["change_id"])) if r["change_id"] is not None else None
+                    last_ack = event_rows.get(int(r["ack_id"])) if r["ack_id"] is not None else None
+                    if change:
                         change_id = int(change.get("id") or 0)
                         ack_change_id = None
                         if last_ack:
                             try:
-                                ack = dict(last_ack[0])
-                                raw = ack.get("payload_json")
+                                raw = last_ack.get("payload_json")
                                 if raw:
                                     payload = json.loads(raw)
                                     if isinstance(payload, dict) and payload.get("ack_change_event_id") is not None:
@@ -1256,6 +1655,15 @@ class Database:
             )
         return out
 
+    def _rows_by_id(self, select_sql: str, ids: List[int]) -> List[sqlite3.Row]:
+        """Rows of `select_sql` (a SELECT without WHERE) whose id is in ids, in chunks of 500."""
+        out: List[sqlite3.Row] = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            chunk += chunk[-1:] * (_padded_len(len(chunk), 500) - len(chunk))
+            out.extend(self._query(f"{select_sql} WHERE id IN ({','.join('?' * len(chunk))})", tuple(chunk)))
+        return out
+
     def create_event(
         self,
         *,
@@ -1278,10 +1686,82 @@ class Database:
                 old_state,
                 new_state,
                 message,
-                json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+                _payload_json(payload),
             ),
         )
 
+    def ack_controlled_files(
+        self, *, device_id: int, expected_change_id: Optional[int], reviewed_by: str, note: str
+    ) -> Tuple[Optional[int], Optional[int]]:
+        """Acknowledge the device's latest controlled_files_change and set its state back to ok.
+
+        Lookup, ack event and state reset share one transaction. Returns (ack event id, latest
+        change id); nothing is written and the ack id is None when there is no change event or
+        expected_change_id is given and is not the latest one.
+        """
+        now = _utc_now_iso()
+        with self._lock, self._conn:
+            hit = self._conn.execute(
+                """
+                SELECT id
+                FROM events
+                WHERE device_id = ? AND event_type = 'controlled_files_change'
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+                """,
+                (int(device_id),),
+            ).fetchone()
+            if hit is None:
+                return None, None
+            change_id = int(hit["id"])
+            if expected_change_id is not None and expected_change_id != change_id:
+                return None, change_id
+            payload = {
+                "device_id": int(device_id),
+                "ack_change_event_id": change_id,
+                "reviewed_by": reviewed_by,
+                "review_note": note,
+                "reviewed_at": now,
+            }
+            cur = self._conn.execute(
+                """
+                INSERT INTO events(device_id, created_at, event_type, old_state, new_state, message, payload_json)
+                VALUES (?, ?, 'controlled_files_ack', NULL, NULL, ?, ?)
+                """,
+                (int(device_id), now, "已确认受控文件变更", json.dumps(payload, ensure_ascii=False)),
+            )
+            # Clear sticky indicator; status still uses snapshot/baseline priority.
+            self._conn.execute(
+                "UPDATE devices SET last_state = 'ok', last_state_at = ?, updated_at = ? WHERE id = ?",
+                (now, now, int(device_id)),
+            )
+            return int(cur.lastrowid), change_id
+
+    def create_events_bulk(self, events: List[Dict[str, Any]]) -> List[int]:
+        """Insert several events (create_event keyword dicts) in one transaction; returns their ids in order."""
+        now = _utc_now_iso()
+        ids: List[int] = []
+        with self._lock, self._conn:
+            for e in events:
+                payload = e.get("payload")
+                cur = self._conn.execute(
+                    """
+                    INSERT INTO events(device_id, created_at, event_type, old_state, new_state, message, payload_json)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        int(e["device_id"]),
+                        now,
+                        str(e["event_type"]),
+                        e.get("old_state"),
+                        e.get("new_state"),
+                        e.get("message"),
+                        _payload_json(payload),
+                    ),
+                )
+                ids.append(int(cur.lastrowid))
+        return ids
+
     def list_events(self, *, limit: int = 50, device_id: Optional[int] = None) -> List[Dict[str, Any]]:
         limit = max(1, min(int(limit), 500))
         if device_id is None:
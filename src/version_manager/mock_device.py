@@ -111,10 +111,20 @@ class MockDeviceHandler(BaseHTTPRequestHandler):
         if self.cfg.get("docs"):
             payload["docs"] = self.cfg["docs"]
 
+        # ETag covers everything but the timestamp, so an unchanged device answers 304.
+        stable = {k: v for k, v in payload.items() if k != "timestamp"}
+        etag = '"' + hashlib.sha256(json.dumps(stable, sort_keys=True).encode("utf-8")).hexdigest()[:32] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
         data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
         self.send_response(200)
         self.send_header("Content-Type", "application/json; charset=utf-8")
         self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
         self.end_headers()
         self.wfile.write(data)
 
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import errno
+import hashlib
+import http.client
 import json
+import selectors
+import socket
+import threading
 import time
-import urllib.error
-import urllib.request
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Tuple
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+from urllib.parse import urljoin, urlsplit
 
 
 @dataclass(frozen=True)
@@ -18,12 +25,244 @@ class PollResult:
     main_version: Optional[str]
     firmware_version: Optional[str]
     payload: Optional[Dict[str, Any]]
+    etag: Optional[str] = None
+    # True when the device answered 304 to If-None-Match: the caller's previous payload still holds.
+    not_modified: bool = False
+    # Digest of the raw response body; equal digests mean an unchanged payload even without ETag support.
+    payload_hash: Optional[str] = None
+
+
+def _ip_family(host: str) -> Optional[int]:
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+        except (OSError, ValueError):
+            continue
+        return family
+    return None
+
+
+def _literal_sockaddr(host: str, port: int) -> Optional[Tuple[int, Tuple[Any, ...]]]:
+    """(family, sockaddr) for an IP literal, or None when ``host`` is not one.
+
+    Scoped IPv6 literals (``fe80::1%eth0``) fail inet_pton; getaddrinfo with AI_NUMERICHOST
+    parses them, scope id included, without a DNS lookup.
+    """
+    family = _ip_family(host)
+    if family is not None:
+        return family, (host, port)
+    try:
+        info = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM, 0, socket.AI_NUMERICHOST)
+    except (OSError, UnicodeError):
+        return None
+    return info[0][0], info[0][4]
+
+
+def _create_connection(
+    address: Tuple[str, int], timeout: Any = None, source_address: Optional[Tuple[str, int]] = None
+) -> socket.socket:
+    """socket.create_connection() without the getaddrinfo() call when the host is an IP literal."""
+    family = _ip_family(address[0])
+    if family is None:
+        return socket.create_connection(address, timeout, source_address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if isinstance(timeout, (int, float)):
+            sock.settimeout(timeout)
+        if source_address:
+            sock.bind(source_address)
+        sock.connect(address)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+class _DeviceConnection(http.client.HTTPConnection):
+    """HTTPConnection that connects to IP-literal hosts (all discover targets) without the resolver."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # the hook HTTPConnection.connect() uses to open its socket
+        self._create_connection = _create_connection
+
+
+class _ConnectionPool:
+    """Idle keep-alive HTTP connections per (host, port).
+
+    The same devices are polled over and over, so a connection the device keeps open is
+    reused instead of paying a TCP handshake per request. Devices that answer HTTP/1.0 or
+    "Connection: close" just get a fresh connection every time, as before.
+
+    Discover sweeps touch many hosts once each, so the total number of idle sockets is capped
+    too: past max_idle_total the host that was idle the longest is closed first.
+    """
+
+    def __init__(self, max_idle_per_host: int = 2, max_idle_total: int = 512):
+        self._max_idle = max_idle_per_host
+        self._max_idle_total = max_idle_total
+        # insertion order: the first key is the host whose idle list was filled longest ago
+        self._idle: Dict[Tuple[str, int], List[http.client.HTTPConnection]] = {}
+        self._idle_total = 0
+        self._lock = threading.Lock()
+
+    def _checkout(self, key: Tuple[str, int]) -> Optional[http.client.HTTPConnection]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if not idle:
+                return None
+            conn = idle.pop()
+            self._idle_total -= 1
+            if not idle:
+                del self._idle[key]
+            return conn
+
+    def _checkin(self, key: Tuple[str, int], conn: http.client.HTTPConnection) -> None:
+        evicted: List[http.client.HTTPConnection] = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) >= self._max_idle:
+                evicted.append(conn)
+            else:
+                idle.append(conn)
+                self._idle_total += 1
+                while self._idle_total > self._max_idle_total:
+                    oldest = next(iter(self._idle))
+                    dropped = self._idle.pop(oldest)
+                    self._idle_total -= len(dropped)
+                    evicted.extend(dropped)
+        for c in evicted:
+            c.close()
+
+    def adopt(self, host: str, port: int, sock: socket.socket) -> None:
+        """Park an already connected socket as an idle connection to (host, port)."""
+        sock.setblocking(True)
+        conn = _DeviceConnection(host, int(port))
+        conn.sock = sock
+        self._checkin((host, int(port)), conn)
+
+    def get(
+        self, host: str, port: int, path: str, headers: Mapping[str, str], timeout_s: float
+    ) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        key = (host, int(port))
+        conn = self._checkout(key)
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = _DeviceConnection(host, int(port), timeout=timeout_s)
+            else:
+                conn.timeout = timeout_s
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout_s)
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if not reused:
+                    raise
+                # the device dropped the idle connection in the meantime; retry once on a new one
+                conn = None
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return resp.status, resp.headers, body
+
+
+_POOL = _ConnectionPool()
+
+
+_REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+_MAX_REDIRECTS = 5
+
+
+def _redirect_target(host: str, port: int, path: str, location: str) -> Optional[Tuple[int, str]]:
+    """(port, path) of a same-host plain-HTTP redirect, or None when it must not be followed."""
+    netloc = f"[{host}]" if ":" in host else host
+    target = urlsplit(urljoin(f"http://{netloc}:{int(port)}{path}", location))
+    if target.scheme != "http" or (target.hostname or "") != host.lower():
+        return None
+    try:
+        target_port = target.port or 80
+    except ValueError:
+        return None
+    return target_port, (target.path or "/") + (f"?{target.query}" if target.query else "")
+
+
+def http_get(
+    host: str, port: int, path: str, headers: Mapping[str, str], timeout_s: float
+) -> Tuple[int, http.client.HTTPMessage, bytes]:
+    """GET over a pooled keep-alive connection; returns (status, headers, body) for any status.
+
+    Up to _MAX_REDIRECTS redirects to the same host are followed; the device's auth headers
+    are never sent to another host, so any other redirect is returned as-is.
+    """
+    for _ in range(_MAX_REDIRECTS):
+        status, resp_headers, body = _POOL.get(host, port, path, headers, timeout_s)
+        location = resp_headers.get("Location")
+        if status not in _REDIRECT_STATUSES or not location:
+            return status, resp_headers, body
+        target = _redirect_target(host, port, path, location)
+        if target is None:
+            return status, resp_headers, body
+        port, path = target
+    return _POOL.get(host, port, path, headers, timeout_s)
+
+
+def tcp_reachable(hosts: List[str], port: int, timeout_s: float) -> Set[str]:
+    """The IP literals in ``hosts`` that accept a TCP connection on ``port`` within ``timeout_s``.
+
+    All connects are started at once on non-blocking sockets, so a batch of dark addresses
+    costs one timeout instead of one per address; keep batches well below the fd limit.
+    Sockets that connect are handed to the keep-alive pool for the HTTP probe that follows.
+    """
+    alive: Set[str] = set()
+    sel = selectors.DefaultSelector()
+    try:
+        for host in hosts:
+            addr = _literal_sockaddr(host, int(port))
+            if addr is None:
+                continue
+            try:
+                sock = socket.socket(addr[0], socket.SOCK_STREAM)
+            except OSError:
+                continue
+            sock.setblocking(False)
+            err = sock.connect_ex(addr[1])
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sock.close()
+                continue
+            sel.register(sock, selectors.EVENT_WRITE, host)
+        deadline = time.monotonic() + timeout_s
+        while sel.get_map():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            for key, _ in sel.select(left):
+                sock = key.fileobj
+                sel.unregister(sock)
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    alive.add(key.data)
+                    _POOL.adopt(key.data, port, sock)
+                else:
+                    sock.close()
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+    return alive
 
 
 def _auth_headers(auth_type: str, auth_token: Optional[str]) -> Dict[str, str]:
     if not auth_type or auth_type == "none":
         return {}
-    token = auth_token or ""
+    token = str(auth_token or "")
     if auth_type == "bearer":
         return {"Authorization": f"Bearer {token}"}
     if auth_type == "x-device-token":
@@ -31,6 +270,17 @@ def _auth_headers(auth_type: str, auth_token: Optional[str]) -> Dict[str, str]:
     return {}
 
 
+@lru_cache(maxsize=1024)
+def _request_headers(auth_type: str, auth_token: Optional[str]) -> Mapping[str, str]:
+    # Built once per credential and shared read-only by every poll and file fetch.
+    return MappingProxyType({"Accept": "application/json", **_auth_headers(auth_type, auth_token)})
+
+
+def device_request_headers(device: Dict[str, Any]) -> Mapping[str, str]:
+    """Accept + auth headers for requests to a device (read-only, cached per credential)."""
+    return _request_headers(str(device.get("auth_type") or "none"), device.get("auth_token"))
+
+
 def _poll_dvp1_http(
     *,
     ip: str,
@@ -39,53 +289,65 @@ def _poll_dvp1_http(
     auth_type: str,
     auth_token: Optional[str],
     timeout_s: float,
+    etag: Optional[str] = None,
 ) -> PollResult:
-    url = f"http://{ip}:{int(port)}{path}"
-    headers = {"Accept": "application/json", **_auth_headers(auth_type, auth_token)}
-    req = urllib.request.Request(url=url, method="GET", headers=headers)
+    headers = _request_headers(auth_type, auth_token)
+    if etag:
+        headers = {**headers, "If-None-Match": etag}
     t0 = time.perf_counter()
     try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            status = getattr(resp, "status", None)
-            raw = resp.read()
-    except urllib.error.HTTPError as e:
+        status, resp_headers, raw = http_get(ip, int(port), path, headers, timeout_s)
+        resp_etag = resp_headers.get("ETag")
+    except OSError as e:
         latency_ms = int((time.perf_counter() - t0) * 1000)
         return PollResult(
             success=False,
-            http_status=int(getattr(e, "code", 0) or 0),
+            http_status=None,
             latency_ms=latency_ms,
-            error=f"http_error:{getattr(e, 'code', '')}",
+            error=f"url_error:{e}",
             protocol_version=None,
             main_version=None,
             firmware_version=None,
             payload=None,
         )
-    except urllib.error.URLError as e:
+    except Exception as e:  # noqa: BLE001
         latency_ms = int((time.perf_counter() - t0) * 1000)
         return PollResult(
             success=False,
             http_status=None,
             latency_ms=latency_ms,
-            error=f"url_error:{getattr(e, 'reason', e)}",
+            error=f"exception:{type(e).__name__}:{e}",
             protocol_version=None,
             main_version=None,
             firmware_version=None,
             payload=None,
         )
-    except Exception as e:  # noqa: BLE001
-        latency_ms = int((time.perf_counter() - t0) * 1000)
+
+    latency_ms = int((time.perf_counter() - t0) * 1000)
+    if not 200 <= status < 300:
+        if etag and status == 304:
+            return PollResult(
+                success=True,
+                http_status=304,
+                latency_ms=latency_ms,
+                error=None,
+                protocol_version=1,
+                main_version=None,
+                firmware_version=None,
+                payload=None,
+                etag=etag,
+                not_modified=True,
+            )
         return PollResult(
             success=False,
-            http_status=None,
+            http_status=status,
             latency_ms=latency_ms,
-            error=f"exception:{type(e).__name__}:{e}",
+            error=f"http_error:{status}",
             protocol_version=None,
             main_version=None,
             firmware_version=None,
             payload=None,
         )
-
-    latency_ms = int((time.perf_counter() - t0) * 1000)
     if status != 200:
         return PollResult(
             success=False,
@@ -156,10 +418,12 @@ def _poll_dvp1_http(
         main_version=main_version,
         firmware_version=firmware_version,
         payload=payload if isinstance(payload, dict) else None,
+        etag=resp_etag or None,
+        payload_hash=hashlib.blake2b(raw, digest_size=16).hexdigest(),
     )
 
 
-def poll_device(device: Dict[str, Any], *, timeout_s: float = 2.0) -> PollResult:
+def poll_device(device: Dict[str, Any], *, timeout_s: float = 2.0, etag: Optional[str] = None) -> PollResult:
     protocol = str(device.get("protocol") or "")
     ip = str(device.get("ip") or "")
     port = int(device.get("port") or 80)
@@ -169,7 +433,7 @@ def poll_device(device: Dict[str, Any], *, timeout_s: float = 2.0) -> PollResult
 
     if protocol == "dvp1-http":
         return _poll_dvp1_http(
-            ip=ip, port=port, path=path, auth_type=auth_type, auth_token=auth_token, timeout_s=timeout_s
+            ip=ip, port=port, path=path, auth_type=auth_type, auth_token=auth_token, timeout_s=timeout_s, etag=etag
         )
 
     return PollResult(
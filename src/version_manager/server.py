@@ -2,37 +2,66 @@ from __future__ import annotations
 
 import argparse
 import base64
+import dataclasses
 import difflib
 import fnmatch
+import gzip
 import hashlib
+import heapq
+import http.client
 import json
+import multiprocessing
 import os
+import queue
+import random
+import re
 import time
 import ipaddress
 import threading
-import urllib.request
-import urllib.error
 import secrets
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timezone
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 from urllib.parse import parse_qs, urlparse
 from urllib.parse import quote
 
+try:
+    import orjson  # type: ignore
+except ImportError:  # optional: faster JSON encoding when installed
+    orjson = None
+
 from .db import Database, DeviceAuth
-from .poller import poll_device
+from .poller import PollResult, device_request_headers, http_get, poll_device, tcp_reachable
+
+
+# (unix second, its ISO string): timestamps have second resolution, so most calls reuse the last one.
+_now_iso: Tuple[int, str] = (0, "")
 
 
 def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    global _now_iso
+    now = int(time.time())
+    cached = _now_iso
+    if cached[0] == now:
+        return cached[1]
+    text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now))
+    _now_iso = (now, text)
+    return text
 
 
 def _read_json(handler: BaseHTTPRequestHandler) -> Dict[str, Any]:
     length = int(handler.headers.get("Content-Length") or 0)
     if length <= 0:
         return {}
+    handler._body_read = True  # type: ignore[attr-defined]
     raw = handler.rfile.read(length)
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # invalid UTF-8, NaN, huge integers...: the stdlib path below decides as before
     try:
         return json.loads(raw.decode("utf-8", errors="replace"))
     except json.JSONDecodeError as e:
@@ -70,6 +99,11 @@ def _get_body_str(body: Dict[str, Any], *keys: str) -> str:
         v = body.get(k)
         if v is None:
             continue
+        if type(v) is str:
+            s = v.strip()
+            if s:
+                return s
+            continue
         if isinstance(v, (str, int, float, bool)):
             s = str(v).strip()
             if s:
@@ -114,28 +148,113 @@ def _present_version_catalog_item(d: Optional[Dict[str, Any]]) -> Optional[Dict[
     return out
 
 
+def _write_response(
+    handler: BaseHTTPRequestHandler,
+    status: int,
+    content_type: str,
+    body: bytes,
+    extra_headers: Tuple[Tuple[str, str], ...] = (),
+    *,
+    length: Optional[str] = None,
+) -> None:
+    """Write status line, headers and body with a single wfile.write.
+
+    Mirrors send_response()/send_header()/end_headers() (logging, Server and
+    Date headers) without the per-header method calls and buffer appends.
+    """
+    handler.log_request(status)
+    head = "%s %d %s\r\nServer: %s\r\nDate: %s\r\nContent-Type: %s\r\n" % (
+        handler.protocol_version,
+        status,
+        handler.responses[status][0] if status in handler.responses else "",
+        handler.version_string(),
+        handler.date_time_string(),
+        content_type,
+    )
+    for k, v in extra_headers:
+        head += f"{k}: {v}\r\n"
+    head += "Cache-Control: no-store\r\nPragma: no-cache\r\nExpires: 0\r\nContent-Length: %s\r\n\r\n" % (
+        length or str(len(body))
+    )
+    handler.wfile.write(head.encode("latin-1", "strict") + body)
+
+
+def _send_json_bytes(
+    handler: BaseHTTPRequestHandler,
+    status: int,
+    data: bytes,
+    length: Optional[str] = None,
+    etag: Optional[str] = None,
+) -> None:
+    if etag is not None and status == 200:
+        # The frontend replays the last ETag it saw and gets an empty 304 when nothing changed.
+        if handler.headers.get("If-None-Match") == etag:
+            handler.log_request(304)
+            head = "%s 304 Not Modified\r\nServer: %s\r\nDate: %s\r\nETag: %s\r\n\r\n" % (
+                handler.protocol_version,
+                handler.version_string(),
+                handler.date_time_string(),
+                etag,
+            )
+            handler.wfile.write(head.encode("latin-1", "strict"))
+            return
+        return _write_response(
+            handler, status, "application/json; charset=utf-8", data, (("ETag", etag),), length=length
+        )
+    _write_response(handler, status, "application/json; charset=utf-8", data, length=length)
+
+
+def _body_etag(data: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _json_bytes(payload: Any) -> bytes:
+    """UTF-8 JSON for a response/event body; encoded by orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits: let the stdlib encoder handle (or reject) it
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
 def _send_json(handler: BaseHTTPRequestHandler, status: int, payload: Any) -> None:
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    handler.send_response(status)
-    handler.send_header("Content-Type", "application/json; charset=utf-8")
-    handler.send_header("Cache-Control", "no-store")
-    handler.send_header("Pragma", "no-cache")
-    handler.send_header("Expires", "0")
-    handler.send_header("Content-Length", str(len(data)))
-    handler.end_headers()
-    handler.wfile.write(data)
-
-
-def _send_html(handler: BaseHTTPRequestHandler, status: int, html: str) -> None:
-    data = html.encode("utf-8")
-    handler.send_response(status)
-    handler.send_header("Content-Type", "text/html; charset=utf-8")
-    handler.send_header("Cache-Control", "no-store")
-    handler.send_header("Pragma", "no-cache")
-    handler.send_header("Expires", "0")
-    handler.send_header("Content-Length", str(len(data)))
-    handler.end_headers()
-    handler.wfile.write(data)
+    _send_json_bytes(handler, status, _json_bytes(payload))
+
+
+def _send_json_list(handler: BaseHTTPRequestHandler, payload: Any) -> None:
+    """200 for a list endpoint the frontend re-reads on every refresh, with an ETag for If-None-Match."""
+    data = _json_bytes(payload)
+    _send_json_bytes(handler, 200, data, etag=_body_etag(data))
+
+
+# Liveness probes hit /api/v1/healthz every few seconds; its body and length never change.
+_HEALTHZ_BODY = _json_bytes({"ok": True})
+_HEALTHZ_LENGTH = str(len(_HEALTHZ_BODY))
+
+# Bodies for the errors every handler (and every scanner probing us) hits.
+_ERROR_BODIES: Dict[str, Tuple[bytes, str]] = {}
+for _k in (
+    "not_found",
+    "unauthorized",
+    "forbidden",
+    "missing_fields",
+    "invalid_device_id",
+    "cluster_not_found",
+    "invalid_credentials",
+    "invalid_json",
+):
+    _b = json.dumps({"error": _k}).encode("utf-8")
+    _ERROR_BODIES[_k] = (_b, str(len(_b)))
+del _k, _b
+
+
+def _send_error(handler: BaseHTTPRequestHandler, status: int, error: str) -> None:
+    pre = _ERROR_BODIES.get(error)
+    if pre is not None:
+        _send_json_bytes(handler, status, pre[0], pre[1])
+        return
+    _send_json_bytes(handler, status, _json_bytes({"error": error}))
 
 
 def _guess_content_type(path: str) -> str:
@@ -161,41 +280,98 @@ def _guess_content_type(path: str) -> str:
     return "application/octet-stream"
 
 
-def _send_bytes(handler: BaseHTTPRequestHandler, status: int, *, data: bytes, content_type: str) -> None:
-    handler.send_response(status)
-    handler.send_header("Content-Type", content_type)
-    handler.send_header("Cache-Control", "no-store")
-    handler.send_header("Pragma", "no-cache")
-    handler.send_header("Expires", "0")
-    handler.send_header("Content-Length", str(len(data)))
-    handler.end_headers()
-    handler.wfile.write(data)
+_GZIP_MIN_BYTES = 1024
+
+
+def _gzip_static(data: bytes, content_type: str) -> Optional[bytes]:
+    if len(data) < _GZIP_MIN_BYTES:
+        return None
+    if not (content_type.startswith("text/") or content_type.startswith("application/json") or content_type == "image/svg+xml"):
+        return None
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+_FRONTEND_MISSING_BYTES = _frontend_missing_html().encode("utf-8")
+_FRONTEND_MISSING_GZ = _gzip_static(_FRONTEND_MISSING_BYTES, "text/html; charset=utf-8")
+
+
+def _accepts_gzip(handler: BaseHTTPRequestHandler) -> bool:
+    return "gzip" in (handler.headers.get("Accept-Encoding") or "")
+
+
+def _send_bytes(
+    handler: BaseHTTPRequestHandler,
+    status: int,
+    *,
+    data: bytes,
+    content_type: str,
+    gz: Optional[bytes] = None,
+) -> None:
+    if gz is None:
+        _write_response(handler, status, content_type, data)
+    elif _accepts_gzip(handler):
+        _write_response(handler, status, content_type, gz, (("Vary", "Accept-Encoding"), ("Content-Encoding", "gzip")))
+    else:
+        _write_response(handler, status, content_type, data, (("Vary", "Accept-Encoding"),))
+
 
 def _redirect(handler: BaseHTTPRequestHandler, location: str) -> None:
-    handler.send_response(302)
-    handler.send_header("Location", location)
-    handler.end_headers()
+    _write_response(handler, 302, "text/plain; charset=utf-8", b"", (("Location", location),))
 
 
 def _path_parts(path: str) -> List[str]:
     return [p for p in path.split("/") if p]
 
-def _parse_cookie(header: Optional[str]) -> Dict[str, str]:
+def _cookie_value(header: Optional[str], name: str) -> Optional[str]:
+    """Value of one cookie in a Cookie header (the last one if repeated); no dict of all cookies."""
     if not header:
-        return {}
-    out: Dict[str, str] = {}
+        return None
+    value = None
     for part in header.split(";"):
-        if "=" not in part:
-            continue
-        k, v = part.split("=", 1)
-        out[k.strip()] = v.strip()
-    return out
+        k, sep, v = part.partition("=")
+        if sep and k.strip() == name:
+            value = v.strip()
+    return value
 
-def _set_cookie(handler: BaseHTTPRequestHandler, name: str, value: str, *, max_age: Optional[int] = None) -> None:
+def _cookie_header(name: str, value: str, *, max_age: Optional[int] = None) -> str:
     parts = [f"{name}={value}", "Path=/", "HttpOnly", "SameSite=Strict"]
     if max_age is not None:
         parts.append(f"Max-Age={int(max_age)}")
-    handler.send_header("Set-Cookie", "; ".join(parts))
+    return "; ".join(parts)
+
+
+def _in_completion_order(futures: Dict[Future, Any]) -> Iterator[Future]:
+    """The futures as they finish, like as_completed().
+
+    Each future's done-callback drops it into one SimpleQueue, so finishing workers do not
+    all take the shared waiter lock as_completed() installs on every future.
+    """
+    done: "queue.SimpleQueue[Future]" = queue.SimpleQueue()
+    for fut in futures:
+        fut.add_done_callback(done.put)
+    for _ in range(len(futures)):
+        yield done.get()
+
+
+def _cidr_hosts(net: Any, limit: int) -> List[str]:
+    """Usable host addresses of ``net`` (same set as ``net.hosts()``), at most ``limit``.
+
+    The range is bounded from the prefix before anything is built, for IPv6 as well.
+    """
+    lo = int(net.network_address)
+    hi = int(net.broadcast_address)
+    if net.version != 4:
+        if net.prefixlen < 127:
+            lo += 1  # Subnet-Router anycast address
+        hi = min(hi, lo + limit - 1)
+        return [str(ipaddress.IPv6Address(i)) for i in range(lo, hi + 1)]
+    if net.prefixlen < 31:
+        lo += 1
+        hi -= 1
+    hi = min(hi, lo + limit - 1)
+    return [
+        "%d.%d.%d.%d" % ((i >> 24) & 0xFF, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF) for i in range(lo, hi + 1)
+    ]
 
 
 def _parse_dvp_url(url: str) -> Optional[Dict[str, Any]]:
@@ -212,25 +388,163 @@ def _parse_dvp_url(url: str) -> Optional[Dict[str, Any]]:
     return {"ip": p.hostname, "port": port, "path": path, "protocol": "dvp1-http"}
 
 
+def _dvp_str(v: Any) -> Optional[str]:
+    return v if isinstance(v, str) else None
+
+
+# Canonical base64 (no whitespace, padding only at the end): its decoded size follows from its length.
+_B64_CANONICAL_RE = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+
+class _TrimmedMatcher(difflib.SequenceMatcher):
+    """SequenceMatcher that only compares the lines between the common head and tail of a and b.
+
+    SequenceMatcher's cost grows with the compared length, while config edits usually touch a
+    few lines of a large file. The head and tail come back as equal opcodes over the untrimmed
+    lists, so get_grouped_opcodes() takes hunk context from the whole file.
+    """
+
+    def __init__(self, a: List[str], b: List[str]):
+        m = min(len(a), len(b))
+        head = 0
+        while head < m and a[head] == b[head]:
+            head += 1
+        tail = 0
+        while tail < m - head and a[-1 - tail] == b[-1 - tail]:
+            tail += 1
+        super().__init__(None, a[head : len(a) - tail], b[head : len(b) - tail])
+        self._head = head
+        self._tail = tail
+        self._lens = (len(a), len(b))
+        self._full_opcodes: Optional[List[Tuple[str, int, int, int, int]]] = None
+
+    def get_opcodes(self) -> List[Tuple[str, int, int, int, int]]:
+        if self._full_opcodes is None:
+            head, tail = self._head, self._tail
+            la, lb = self._lens
+            ops: List[Tuple[str, int, int, int, int]] = []
+
+            def add(tag: str, i1: int, i2: int, j1: int, j2: int) -> None:
+                if i1 == i2 and j1 == j2:
+                    return
+                if ops and tag == "equal" and ops[-1][0] == "equal":
+                    ops[-1] = ("equal", ops[-1][1], i2, ops[-1][3], j2)
+                else:
+                    ops.append((tag, i1, i2, j1, j2))
+
+            add("equal", 0, head, 0, head)
+            for tag, i1, i2, j1, j2 in super().get_opcodes():
+                add(tag, i1 + head, i2 + head, j1 + head, j2 + head)
+            add("equal", la - tail, la, lb - tail, lb)
+            self._full_opcodes = ops
+        return self._full_opcodes
+
+
+def _unified_range(start: int, stop: int) -> str:
+    # same as difflib's hunk range format: "start,length", "start" for one line, "start-1,0" for none
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    return f"{start + 1 if length else start},{length}"
+
+
+def _unified_diff(a: List[str], b: List[str], *, fromfile: str, tofile: str, n: int = 3) -> str:
+    """A unified diff in difflib.unified_diff's format, with the matching done by _TrimmedMatcher."""
+    if a == b:
+        return ""
+    out: List[str] = []
+    for group in _TrimmedMatcher(a, b).get_grouped_opcodes(n):
+        if not out:
+            out.append(f"--- {fromfile}\n")
+            out.append(f"+++ {tofile}\n")
+        first, last = group[0], group[-1]
+        out.append(f"@@ -{_unified_range(first[1], last[2])} +{_unified_range(first[3], last[4])} @@\n")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                out.extend(" " + line for line in a[i1:i2])
+                continue
+            if tag in ("replace", "delete"):
+                out.extend("-" + line for line in a[i1:i2])
+            if tag in ("replace", "insert"):
+                out.extend("+" + line for line in b[j1:j2])
+    return "".join(out)
+
+
+# Diffs of at least this much content (old + new bytes) run in a worker process, off the GIL.
+_DIFF_PROCESS_MIN_BYTES = 256 * 1024
+_DIFF_MAX_CHARS = 50_000
+
+
+def _compute_diff(old_bytes: bytes, new_bytes: bytes, enc: str, fromfile: str, tofile: str) -> Tuple[str, bool]:
+    """(unified diff, truncated) of two captured contents; module-level so a process pool can run it."""
+    if old_bytes == new_bytes:
+        # fingerprint moved (e.g. mtime only) but the captured content is identical
+        return "", False
+    diff = _unified_diff(
+        old_bytes.decode(enc, errors="replace").splitlines(True),
+        new_bytes.decode(enc, errors="replace").splitlines(True),
+        fromfile=fromfile,
+        tofile=tofile,
+        n=3,
+    )
+    if len(diff) > _DIFF_MAX_CHARS:
+        return diff[:_DIFF_MAX_CHARS] + "\n... (diff truncated)\n", True
+    return diff, False
+
+
+# (patterns as written, patterns with "\\" read as "/" or None when no pattern has a backslash)
+_PathGlobs = Tuple["re.Pattern[str]", Optional["re.Pattern[str]"]]
+
+
+def _controlled_rule_key(rule: Optional[Dict[str, Any]]) -> Optional[Tuple[Any, ...]]:
+    """What a controlled-file check depends on from its rule; None when no rule applies."""
+    if not rule:
+        return None
+    return (rule.get("id"), rule.get("paths_json"), rule.get("mode"), rule.get("max_bytes"))
+
+
+def _compile_path_globs(patterns: List[Any]) -> _PathGlobs:
+    """Compile glob patterns into alternation regexes for App._select_controlled_files.
+
+    A path is selected when it matches a pattern as written, or when both path and pattern
+    match with backslashes read as slashes (Windows paths / mixed separators).
+    """
+    pats = [str(p) for p in patterns]
+    exact = re.compile("|".join(fnmatch.translate(p) for p in pats))
+    if not any("\\" in p for p in pats):
+        return exact, None
+    slashed = re.compile("|".join(fnmatch.translate(p.replace("\\", "/")) for p in pats))
+    return exact, slashed
+
+
+@lru_cache(maxsize=4096)
+def _infer_cached(
+    did: Optional[str], serial: Optional[str], supplier: Optional[str], device_type: Optional[str]
+) -> Tuple[Tuple[str, str], ...]:
+    out: List[Tuple[str, str]] = []
+    if serial is not None and serial.strip():
+        out.append(("device_serial", serial.strip()))
+    elif did is not None and did.strip():
+        out.append(("device_serial", did.strip()))
+    if supplier is not None and supplier.strip():
+        out.append(("supplier", supplier.strip()))
+    if device_type is not None and device_type.strip():
+        out.append(("device_type", device_type.strip()))
+    return tuple(out)
+
+
 def _infer_from_dvp(payload: Dict[str, Any]) -> Dict[str, str]:
     device_obj = payload.get("device", {}) if isinstance(payload, dict) else {}
-    out: Dict[str, str] = {}
-    if isinstance(device_obj, dict):
-        did = device_obj.get("id")
-        serial = device_obj.get("serial")
-        if isinstance(serial, str) and serial.strip():
-            out["device_serial"] = serial.strip()
-        elif isinstance(did, str) and did.strip():
-            out["device_serial"] = did.strip()
-
-        supplier = device_obj.get("supplier")
-        if isinstance(supplier, str) and supplier.strip():
-            out["supplier"] = supplier.strip()
-
-        device_type = device_obj.get("device_type")
-        if isinstance(device_type, str) and device_type.strip():
-            out["device_type"] = device_type.strip()
-    return out
+    if not isinstance(device_obj, dict):
+        return {}
+    # devices report the same identity on every poll; only the raw strings key the cache
+    return dict(
+        _infer_cached(
+            _dvp_str(device_obj.get("id")),
+            _dvp_str(device_obj.get("serial")),
+            _dvp_str(device_obj.get("supplier")),
+            _dvp_str(device_obj.get("device_type")),
+        )
+    )
 
 
 MAX_DEVICE_CHANGELOG_CHARS = 200_000
@@ -1993,6 +2307,67 @@ document.getElementById("go").addEventListener("click", async () => {{
 </html>"""
 
 
+# The login and setup pages are constant apart from the login hint: rendered, encoded and
+# gzipped once here.
+_LOGIN_PAGES: Dict[bool, Tuple[bytes, Optional[bytes]]] = {}
+for _setup_needed in (False, True):
+    _b = _login_html(setup_needed=_setup_needed).encode("utf-8")
+    _LOGIN_PAGES[_setup_needed] = (_b, _gzip_static(_b, "text/html; charset=utf-8"))
+del _setup_needed, _b
+_SETUP_PAGE_BYTES = _setup_html().encode("utf-8")
+_SETUP_PAGE_GZ = _gzip_static(_SETUP_PAGE_BYTES, "text/html; charset=utf-8")
+
+
+# Seconds between ": ping" comments on an idle event stream (keeps proxies from timing it out).
+_SSE_HEARTBEAT_S = 15.0
+# How long a version catalog row may be served from memory; admin edits invalidate it immediately.
+_CATALOG_TTL_S = 60.0
+# How long a session cookie is trusted without asking the database again. A logout, or any commit
+# from another connection (a --reuse-port sibling, the password-reset CLI), ends the trust early.
+_SESSION_CACHE_TTL_S = 30.0
+
+
+class _EventHub:
+    """Fan-out of device events to connected /api/v1/events/stream clients.
+
+    Each subscriber owns a bounded queue; a client too slow to drain it loses events rather
+    than stalling the poller (the page reloads its state on the next event anyway).
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self._maxsize = maxsize
+        self._subscribers: List["queue.Queue[bytes]"] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> "queue.Queue[bytes]":
+        q: "queue.Queue[bytes]" = queue.Queue(maxsize=self._maxsize)
+        with self._lock:
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q: "queue.Queue[bytes]") -> None:
+        with self._lock:
+            try:
+                self._subscribers.remove(q)
+            except ValueError:
+                pass
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def publish(self, item: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        data = _json_bytes(item)
+        for q in subscribers:
+            try:
+                q.put_nowait(data)
+            except queue.Full:
+                pass
+
+
 class App:
     def __init__(
         self,
@@ -2005,19 +2380,134 @@ class App:
         webhook_url: Optional[str] = None,
         api_token: Optional[str] = None,
         frontend_dist: Optional[str] = None,
+        max_poll_interval_s: float = 0.0,
     ):
         self.db = db
         self.poll_workers = poll_workers
         self.registration_token = registration_token
         self.default_cluster_id = default_cluster_id
         self.poll_interval_s = float(poll_interval_s)
+        # Upper bound for the per-device backoff; at or below poll_interval_s every device is polled every tick.
+        self.max_poll_interval_s = float(max_poll_interval_s)
+        # device id -> (current interval, monotonic time it is due again)
+        self._poll_backoff: Dict[int, Tuple[float, float]] = {}
         self.webhook_url = webhook_url
+        self.webhook_enabled = bool(webhook_url)
         self.api_token = api_token
+        # compared as bytes against X-Api-Token re-encoded as latin-1, which is how http.server
+        # decoded it: the raw header bytes (str compare_digest rejects non-ASCII input)
+        self.api_token_bytes = api_token.encode("utf-8") if api_token else None
         self.frontend_dist = os.path.abspath(frontend_dist) if frontend_dist else None
         if self.frontend_dist and not os.path.isdir(self.frontend_dist):
             self.frontend_dist = None
         self._stop_event = threading.Event()
         self._scheduler_thread: Optional[threading.Thread] = None
+        # Created by start_scheduler and reused by every tick.
+        self._poll_executor: Optional[ThreadPoolExecutor] = None
+        # Run the fan-out of /api/v1/poll and /api/v1/discover, keyed by endpoint; each is started on
+        # first use and kept, so those requests no longer build and tear down a pool of threads each
+        # time. Separate pools keep a large discover sweep from queueing ahead of manual polls.
+        self._request_executors: Dict[str, ThreadPoolExecutor] = {}
+        self._request_executor_lock = threading.Lock()
+        # Shared by all polls for controlled-file content fetches (I/O bound, never nested).
+        self._fetch_executor = ThreadPoolExecutor(
+            max_workers=max(4, int(poll_workers)), thread_name_prefix="vm-file-fetch"
+        )
+        # key -> Future of the call currently running for it (see _single_flight)
+        self._inflight: Dict[Tuple[Any, ...], Future] = {}
+        self._inflight_lock = threading.Lock()
+        # path -> (mtime_ns, size, raw, gzipped); compressed once per file version.
+        self._static_cache: Dict[str, Tuple[int, int, bytes, Optional[bytes]]] = {}
+        self._static_lock = threading.Lock()
+        # (db data_version, encoded /api/v1/status body, its ETag); rebuilt after any write.
+        self._status_cache: Optional[Tuple[Tuple[int, int], bytes, str]] = None
+        self._status_lock = threading.Lock()
+        # Started on first use: most deployments never see a controlled file large enough to need it.
+        self._diff_executor: Optional[ProcessPoolExecutor] = None
+        self._diff_lock = threading.Lock()
+        self.events = _EventHub()
+        # Webhook payloads waiting for the single background sender (started on the first event).
+        self._webhook_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+        self._webhook_thread: Optional[threading.Thread] = None
+        self._webhook_lock = threading.Lock()
+        # controlled-file rule id -> (paths_json it was compiled from, compiled globs)
+        self._glob_cache: Dict[int, Tuple[str, _PathGlobs]] = {}
+        # device id -> (snapshot id, extracted file entries, files supported, _controlled_rule_key of
+        # the rule it was checked under) of its last checked poll
+        self._file_entries_cache: Dict[
+            int, Tuple[int, Dict[str, Dict[str, Any]], bool, Optional[Tuple[Any, ...]]]
+        ] = {}
+        # (vendor, model, main_version) -> (monotonic expiry, catalog row); misses are not cached
+        self._catalog_cache: Dict[Tuple[str, str, str], Tuple[float, Dict[str, Any]]] = {}
+        # session token -> (monotonic expiry, external data_version when read, user); only valid
+        # sessions are cached
+        self._session_cache: Dict[str, Tuple[float, int, Dict[str, Any]]] = {}
+
+    def _single_flight(self, key: Tuple[Any, ...], fn: Callable[[], Any]) -> Any:
+        """Run fn() once per key at a time; concurrent callers with the same key share its result.
+
+        A manual "poll all" overlapping a scheduler tick would otherwise poll the same device
+        and fetch the same controlled files twice.
+        """
+        with self._inflight_lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = Future()
+                self._inflight[key] = fut
+        if not owner:
+            return fut.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def status_body(self) -> Tuple[bytes, str]:
+        """Encoded /api/v1/status body and its ETag; both are rebuilt only after a write."""
+        version = self.db.data_version()
+        cached = self._status_cache
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        with self._status_lock:
+            cached = self._status_cache
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2]
+            out: List[Dict[str, Any]] = []
+            for r in self.db.list_status():
+                rr = dict(r)
+                rr["device"] = _present_device(rr.get("device"))
+                rr["baseline"] = _present_baseline(rr.get("baseline"))
+                out.append(rr)
+            data = _json_bytes({"items": out, "timestamp": _utc_now_iso()})
+            etag = _body_etag(data)
+            self._status_cache = (version, data, etag)
+            return data, etag
+
+    def read_static(self, path: str) -> Optional[Tuple[bytes, Optional[bytes]]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._static_lock:
+            hit = self._static_cache.get(path)
+        if hit is not None and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+            return hit[2], hit[3]
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except Exception:
+            return None
+        gz = _gzip_static(data, _guess_content_type(path))
+        with self._static_lock:
+            self._static_cache[path] = (st.st_mtime_ns, st.st_size, data, gz)
+        return data, gz
 
     @staticmethod
     def _extract_reported_file_entries(payload: Any) -> tuple[Dict[str, Dict[str, Any]], bool]:
@@ -2036,7 +2526,7 @@ class App:
             if not path:
                 continue
             checksum = item.get("checksum")
-            checksum_s = checksum.strip() if isinstance(checksum, str) and checksum.strip() else None
+            checksum_s = (checksum.strip() or None) if isinstance(checksum, str) else None
             size = item.get("size", None)
             mtime = item.get("mtime", None)
             fp: Optional[str] = checksum_s
@@ -2055,8 +2545,9 @@ class App:
                 "truncated": bool(item.get("truncated", False)),
             }
             content_b64 = item.get("content_b64")
-            if isinstance(content_b64, str) and content_b64.strip():
-                entry["content_b64"] = content_b64.strip()
+            content_b64 = content_b64.strip() if isinstance(content_b64, str) else None
+            if content_b64:
+                entry["content_b64"] = content_b64
             else:
                 content = item.get("content")
                 if isinstance(content, str):
@@ -2065,46 +2556,134 @@ class App:
             out[path] = entry
         return out, True
 
-    @staticmethod
-    def _path_matches(pattern: str, path: str) -> bool:
-        pat = str(pattern)
-        p = str(path)
-        if fnmatch.fnmatchcase(p, pat):
-            return True
-        # help windows paths / mixed slashes
-        return fnmatch.fnmatchcase(p.replace("\\", "/"), pat.replace("\\", "/"))
+    def _diff_pool(self) -> ProcessPoolExecutor:
+        with self._diff_lock:
+            if self._diff_executor is None:
+                # spawn: forking a process that runs request and poll threads is not safe
+                self._diff_executor = ProcessPoolExecutor(
+                    max_workers=min(4, os.cpu_count() or 1), mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._diff_executor
+
+    def _run_diffs(self, jobs: List[Tuple[Dict[str, Any], Tuple[bytes, bytes, str, str, str]]]) -> None:
+        """Fill diff_unified on each change; large diffs run in parallel worker processes."""
+        remote: List[Tuple[Dict[str, Any], Tuple[bytes, bytes, str, str, str], Future]] = []
+        local: List[Tuple[Dict[str, Any], Tuple[bytes, bytes, str, str, str]]] = []
+        for ch, args in jobs:
+            if len(args[0]) + len(args[1]) >= _DIFF_PROCESS_MIN_BYTES:
+                try:
+                    remote.append((ch, args, self._diff_pool().submit(_compute_diff, *args)))
+                    continue
+                except Exception:
+                    pass
+            local.append((ch, args))
+        for ch, args in local:
+            try:
+                diff, truncated = _compute_diff(*args)
+            except Exception:
+                continue
+            ch["diff_unified"] = diff
+            if truncated:
+                ch["diff_truncated"] = True
+        for ch, args, fut in remote:
+            try:
+                diff, truncated = fut.result()
+            except Exception:
+                # broken pool: diff in-process rather than drop it
+                try:
+                    diff, truncated = _compute_diff(*args)
+                except Exception:
+                    continue
+            ch["diff_unified"] = diff
+            if truncated:
+                ch["diff_truncated"] = True
+
+    def catalog_item(self, *, vendor: str, model: str, main_version: str) -> Optional[Dict[str, Any]]:
+        """Version catalog row for (vendor, model, main_version), cached for _CATALOG_TTL_S."""
+        key = (vendor, model, main_version)
+        now = time.monotonic()
+        hit = self._catalog_cache.get(key)
+        if hit is not None and hit[0] > now:
+            return dict(hit[1])
+        item = self.db.get_version_catalog_item(vendor=vendor, model=model, main_version=main_version)
+        if item is None:
+            return None
+        self._catalog_cache[key] = (now + _CATALOG_TTL_S, item)
+        return dict(item)
+
+    def invalidate_catalog_item(self, *, vendor: str, model: str, main_version: str) -> None:
+        self._catalog_cache.pop((vendor, model, main_version), None)
+
+    def session_user(self, token: str) -> Optional[Dict[str, Any]]:
+        """User behind a session token; a dashboard load sends several requests with the same cookie.
+
+        A cached session is only used while no other connection has committed to the database since
+        it was read, so a logout handled by another --reuse-port process (or a password reset from
+        the CLI) takes effect on the next request. Otherwise it may outlive its expiry by at most
+        _SESSION_CACHE_TTL_S.
+        """
+        now = time.monotonic()
+        external = self.db.data_version()[1]
+        hit = self._session_cache.get(token)
+        if hit is not None and hit[0] > now and hit[1] == external:
+            return dict(hit[2])
+        u = self.db.get_session_user(token=token)
+        if u is None:
+            self._session_cache.pop(token, None)
+            return None
+        if len(self._session_cache) >= 1024:
+            for k, (expires, _, _) in list(self._session_cache.items()):
+                if expires <= now:
+                    self._session_cache.pop(k, None)
+        self._session_cache[token] = (now + _SESSION_CACHE_TTL_S, external, u)
+        return dict(u)
+
+    def end_session(self, token: str) -> None:
+        self._session_cache.pop(token, None)
+        self.db.delete_session(token=token)
+
+    def _rule_globs(self, rule: Dict[str, Any]) -> _PathGlobs:
+        """Compiled globs for a controlled-file rule, reused until the rule's paths change."""
+        rule_id = int(rule["id"])
+        stamp = str(rule.get("paths_json") or "")
+        hit = self._glob_cache.get(rule_id)
+        if hit is not None and hit[0] == stamp:
+            return hit[1]
+        globs = _compile_path_globs(rule.get("paths") or [])
+        self._glob_cache[rule_id] = (stamp, globs)
+        return globs
 
-    @classmethod
+    @staticmethod
     def _select_controlled_files(
-        cls, files: Dict[str, Dict[str, Any]], patterns: List[str]
+        files: Dict[str, Dict[str, Any]], globs: _PathGlobs
     ) -> Dict[str, Dict[str, Any]]:
-        if not files or not patterns:
+        if not files:
             return {}
+        exact, slashed = globs
+        normalized = slashed or exact
         out: Dict[str, Dict[str, Any]] = {}
         for path, entry in files.items():
-            for pat in patterns:
-                if cls._path_matches(str(pat), path):
+            if exact.match(path):
+                out[path] = entry
+            elif "\\" in path:
+                if normalized.match(path.replace("\\", "/")):
                     out[path] = entry
-                    break
+            elif slashed is not None and slashed.match(path):
+                # a backslash pattern can still match a plain path once it is read with slashes
+                out[path] = entry
         return out
 
-    @staticmethod
-    def _device_auth_headers(device: Dict[str, Any]) -> Dict[str, str]:
-        auth_type = str(device.get("auth_type") or "none")
-        auth_token = device.get("auth_token")
-        if not auth_type or auth_type == "none":
-            return {}
-        token = str(auth_token or "")
-        if auth_type == "bearer":
-            return {"Authorization": f"Bearer {token}"}
-        if auth_type == "x-device-token":
-            return {"X-Device-Token": token}
-        return {}
-
     @staticmethod
     def _truncate_b64(content_b64: str, *, max_bytes: int) -> tuple[Optional[str], bool]:
         if max_bytes <= 0:
             return None, True
+        n = len(content_b64)
+        if n % 4 == 0 and _B64_CANONICAL_RE.fullmatch(content_b64):
+            # Size check without decoding; when over the limit decode only the kept prefix.
+            if n // 4 * 3 - (n - len(content_b64.rstrip("="))) <= max_bytes:
+                return content_b64, False
+            raw = base64.b64decode(content_b64[: -(-max_bytes // 3) * 4])
+            return base64.b64encode(raw[:max_bytes]).decode("ascii"), True
         try:
             raw = base64.b64decode(content_b64, validate=False)
         except Exception:
@@ -2115,16 +2694,22 @@ class App:
 
     def _fetch_file_content(
         self, *, device: Dict[str, Any], path: str, timeout_s: float, max_bytes: int
+    ) -> Optional[Dict[str, Any]]:
+        return self._single_flight(
+            ("file", int(device["id"]), str(path), int(max_bytes)),
+            lambda: self._fetch_file_content_uncached(
+                device=device, path=path, timeout_s=timeout_s, max_bytes=max_bytes
+            ),
+        )
+
+    def _fetch_file_content_uncached(
+        self, *, device: Dict[str, Any], path: str, timeout_s: float, max_bytes: int
     ) -> Optional[Dict[str, Any]]:
         ip = str(device.get("ip") or "").strip()
         port = int(device.get("port") or 80)
-        url = f"http://{ip}:{port}/.well-known/device-version/file?path={quote(str(path), safe='')}"
-        headers = {"Accept": "application/json", **self._device_auth_headers(device)}
-        req = urllib.request.Request(url=url, method="GET", headers=headers)
+        target = f"/.well-known/device-version/file?path={quote(str(path), safe='')}"
         try:
-            with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-                status = getattr(resp, "status", None)
-                raw = resp.read()
+            status, _, raw = http_get(ip, port, target, device_request_headers(device), timeout_s)
         except Exception:
             return None
         if status != 200:
@@ -2166,6 +2751,32 @@ class App:
         fp = str(entry.get("fingerprint") or "")
         if not path or not fp or max_bytes <= 0:
             return None
+        return self._single_flight(
+            ("observation", int(device["id"]), path, fp),
+            lambda: self._ensure_observation_uncached(
+                device=device,
+                entry=entry,
+                path=path,
+                fp=fp,
+                snapshot_id=snapshot_id,
+                timeout_s=timeout_s,
+                mode=mode,
+                max_bytes=max_bytes,
+            ),
+        )
+
+    def _ensure_observation_uncached(
+        self,
+        *,
+        device: Dict[str, Any],
+        entry: Dict[str, Any],
+        path: str,
+        fp: str,
+        snapshot_id: int,
+        timeout_s: float,
+        mode: str,
+        max_bytes: int,
+    ) -> Optional[Dict[str, Any]]:
         existing = self.db.get_controlled_file_observation(device_id=int(device["id"]), path=path, fingerprint=fp)
         if existing:
             return existing
@@ -2218,19 +2829,17 @@ class App:
         self,
         *,
         device: Dict[str, Any],
+        rule: Optional[Dict[str, Any]],
         poll_result: Any,
         prev_success_snapshot: Optional[Dict[str, Any]],
         current_snapshot_id: int,
     ) -> List[Dict[str, Any]]:
         if not getattr(poll_result, "success", False):
             return []
-        rule = self.db.get_controlled_file_rule(
-            cluster_id=int(device["cluster_id"]),
-            vendor=str(device["vendor"]),
-            model=str(device["model"]),
-        )
+        device_id = int(device["id"])
         patterns = (rule or {}).get("paths") or []
         if not patterns:
+            self._file_entries_cache.pop(device_id, None)
             return []
         mode = str((rule or {}).get("mode") or "auto").strip().lower() or "auto"
         if mode not in ("auto", "inline", "fetch"):
@@ -2243,13 +2852,22 @@ class App:
         max_bytes = max(0, min(max_bytes, 2_000_000))
 
         curr_entries, curr_supported = self._extract_reported_file_entries(getattr(poll_result, "payload", None))
+        # The previous snapshot is usually the one this device's last check already walked.
+        cached = self._file_entries_cache.get(device_id)
+        self._file_entries_cache[device_id] = (
+            int(current_snapshot_id), curr_entries, curr_supported, _controlled_rule_key(rule)
+        )
         if not curr_supported:
             return []
-        prev_payload = prev_success_snapshot.get("payload") if prev_success_snapshot else None
-        prev_entries, prev_supported = self._extract_reported_file_entries(prev_payload)
+        if cached is not None and prev_success_snapshot and cached[0] == int(prev_success_snapshot["id"]):
+            prev_entries, prev_supported = cached[1], cached[2]
+        else:
+            prev_payload = prev_success_snapshot.get("payload") if prev_success_snapshot else None
+            prev_entries, prev_supported = self._extract_reported_file_entries(prev_payload)
 
-        curr_sel = self._select_controlled_files(curr_entries, patterns)
-        prev_sel = self._select_controlled_files(prev_entries, patterns) if prev_supported else {}
+        globs = self._rule_globs(rule)
+        curr_sel = self._select_controlled_files(curr_entries, globs)
+        prev_sel = self._select_controlled_files(prev_entries, globs) if prev_supported else {}
         if not curr_sel and not prev_sel:
             return []
 
@@ -2260,10 +2878,18 @@ class App:
             timeout_s = 2.0
         timeout_s = max(0.2, min(timeout_s, 5.0))
 
-        # store baseline observations (so future diffs have old content)
-        for path, entry in curr_sel.items():
+        # Every stored observation this check can use, in one query: current files whose
+        # content is already captured need no further work, previous ones feed the diffs.
+        known = self.db.get_controlled_file_observations_bulk(
+            device_id=device_id,
+            keys=[(p, str(e.get("fingerprint") or "")) for sel in (curr_sel, prev_sel) for p, e in sel.items()],
+        )
+
+        # store baseline observations (so future diffs have old content); the per-file
+        # device fetches are independent, so they run concurrently instead of back to back.
+        def ensure(entry: Dict[str, Any]) -> None:
             try:
-                self._ensure_observation_for_entry(
+                obs = self._ensure_observation_for_entry(
                     device=device,
                     entry=entry,
                     snapshot_id=int(current_snapshot_id),
@@ -2272,22 +2898,40 @@ class App:
                     max_bytes=max_bytes,
                 )
             except Exception:
-                pass
+                return
+            if obs:
+                known[(str(obs["path"]), str(obs["fingerprint"]))] = obs
+
+        pending = [e for p, e in curr_sel.items() if (p, str(e.get("fingerprint") or "")) not in known]
+        if len(pending) > 1:
+            list(self._fetch_executor.map(ensure, pending))
+        else:
+            for entry in pending:
+                ensure(entry)
 
         # first time supporting files => just establish baseline, no event
         if not prev_supported:
             return []
 
+        # One pass over current paths plus the ones that disappeared; only the (few) changes get sorted.
         changes: List[Dict[str, Any]] = []
-        for path in sorted(set(prev_sel.keys()) | set(curr_sel.keys())):
-            old_fp = (prev_sel.get(path) or {}).get("fingerprint") if prev_sel.get(path) else None
-            new_fp = (curr_sel.get(path) or {}).get("fingerprint") if curr_sel.get(path) else None
+        for path, curr_entry in curr_sel.items():
+            prev_entry = prev_sel.get(path)
+            old_fp = prev_entry.get("fingerprint") if prev_entry else None
+            new_fp = curr_entry.get("fingerprint") if curr_entry else None
             if old_fp != new_fp:
                 changes.append({"path": path, "old": old_fp, "new": new_fp})
+        for path, prev_entry in prev_sel.items():
+            if path not in curr_sel:
+                old_fp = prev_entry.get("fingerprint") if prev_entry else None
+                if old_fp is not None:
+                    changes.append({"path": path, "old": old_fp, "new": None})
         if not changes:
             return []
+        changes.sort(key=lambda ch: ch["path"])
 
         # enrich with optional content + diff
+        diff_jobs: List[Tuple[Dict[str, Any], Tuple[bytes, bytes, str, str, str]]] = []
         for ch in changes:
             path = str(ch.get("path") or "")
             old_fp = str(ch.get("old") or "") if ch.get("old") is not None else ""
@@ -2306,13 +2950,14 @@ class App:
                         "source": "inline",
                     }
             if old_obs is None and old_fp:
-                old_obs = self.db.get_controlled_file_observation(
-                    device_id=int(device["id"]), path=path, fingerprint=old_fp
-                )
+                old_obs = known.get((path, old_fp))
 
             new_obs = None
             curr_entry = curr_sel.get(path)
-            if curr_entry and new_fp:
+            if curr_entry and new_fp and max_bytes > 0:
+                new_obs = known.get((path, new_fp))
+            if new_obs is None and curr_entry and new_fp:
+                # not captured above (e.g. the fetch failed): one more attempt
                 new_obs = self._ensure_observation_for_entry(
                     device=device,
                     entry=curr_entry,
@@ -2339,29 +2984,24 @@ class App:
                 and max_bytes > 0
             ):
                 try:
-                    old_bytes = base64.b64decode(old_obs["content_b64"], validate=False)
-                    new_bytes = base64.b64decode(new_obs["content_b64"], validate=False)
+                    # rows stored compressed already carry the raw bytes; no need to go through base64
+                    old_bytes = old_obs.get("content")
+                    if not isinstance(old_bytes, bytes):
+                        old_bytes = base64.b64decode(old_obs["content_b64"], validate=False)
+                    new_bytes = new_obs.get("content")
+                    if not isinstance(new_bytes, bytes):
+                        new_bytes = base64.b64decode(new_obs["content_b64"], validate=False)
                     enc = (
                         str(new_obs.get("encoding") or old_obs.get("encoding") or "utf-8")
                         if isinstance(new_obs.get("encoding") or old_obs.get("encoding"), str)
                         else "utf-8"
                     )
-                    old_text = old_bytes.decode(enc, errors="replace")
-                    new_text = new_bytes.decode(enc, errors="replace")
-                    diff_lines = difflib.unified_diff(
-                        old_text.splitlines(True),
-                        new_text.splitlines(True),
-                        fromfile=f"{path}@{old_fp or 'old'}",
-                        tofile=f"{path}@{new_fp or 'new'}",
-                        n=3,
+                    diff_jobs.append(
+                        (ch, (old_bytes, new_bytes, enc, f"{path}@{old_fp or 'old'}", f"{path}@{new_fp or 'new'}"))
                     )
-                    diff = "".join(diff_lines)
-                    if len(diff) > 50_000:
-                        diff = diff[:50_000] + "\n... (diff truncated)\n"
-                        ch["diff_truncated"] = True
-                    ch["diff_unified"] = diff
                 except Exception:
                     pass
+        self._run_diffs(diff_jobs)
 
         paths_changed = [str(x.get("path") or "") for x in changes if str(x.get("path") or "").strip()]
         short = ", ".join(paths_changed[:3])
@@ -2388,23 +3028,46 @@ class App:
                 "current_snapshot_id": int(current_snapshot_id),
             },
         )
-        self._notify_webhook(
-            {
-                "event_id": event_id,
-                "event_type": "controlled_files_change",
-                "timestamp": _utc_now_iso(),
-            }
-        )
+        if self._has_event_listeners():
+            self._emit_event(
+                device_id,
+                {
+                    "event_id": event_id,
+                    "event_type": "controlled_files_change",
+                    "timestamp": _utc_now_iso(),
+                }
+            )
         return changes
 
     def poll_and_record(self, device: Dict[str, Any], *, timeout_s: float = 2.0) -> Dict[str, Any]:
+        return self._single_flight(
+            ("poll", int(device["id"])), lambda: self._poll_and_record(device, timeout_s=timeout_s)
+        )
+
+    def _poll_and_record(self, device: Dict[str, Any], *, timeout_s: float) -> Dict[str, Any]:
         device_id = int(device["id"])
+        vendor = device["vendor"].strip()
+        model = device["model"].strip()
         prev = self.db.get_latest_success_snapshot(device_id)
         prev_main = (str(prev.get("main_version")) if prev and prev.get("main_version") is not None else None)
         started = time.perf_counter()
-        res = poll_device(device, timeout_s=timeout_s)
+        res = poll_device(device, timeout_s=timeout_s, etag=(prev.get("etag") if prev else None))
         elapsed_ms = int((time.perf_counter() - started) * 1000)
         latency_ms = res.latency_ms if res.latency_ms is not None else elapsed_ms
+        if res.not_modified and prev:
+            # 304: the device state is byte-for-byte the previous one; reuse it instead of re-parsing.
+            res = dataclasses.replace(
+                res,
+                protocol_version=prev.get("protocol_version"),
+                main_version=prev.get("main_version"),
+                firmware_version=prev.get("firmware_version"),
+                payload=prev.get("payload"),
+                payload_hash=prev.get("payload_hash"),
+            )
+        # Same body as the last success (304, or an identical digest for devices without ETag).
+        unchanged = prev is not None and (
+            res.not_modified or (res.payload_hash is not None and res.payload_hash == prev.get("payload_hash"))
+        )
         snapshot_id = self.db.record_snapshot(
             device_id=device_id,
             success=res.success,
@@ -2415,12 +3078,15 @@ class App:
             main_version=res.main_version,
             firmware_version=res.firmware_version,
             payload=res.payload,
+            etag=res.etag,
+            payload_hash=res.payload_hash,
+            payload_json=prev.get("payload_json") if unchanged and prev else None,
         )
-        if res.success and res.main_version:
+        if res.success and res.main_version and not unchanged:
             try:
                 self.db.ensure_version_catalog_entry(
-                    vendor=str(device.get("vendor") or "").strip(),
-                    model=str(device.get("model") or "").strip(),
+                    vendor=vendor,
+                    model=model,
                     main_version=str(res.main_version),
                 )
             except Exception:
@@ -2428,16 +3094,23 @@ class App:
             try:
                 info = _extract_main_version_info(res.payload if isinstance(res.payload, dict) else None)
                 self.db.upsert_device_version_info(
-                    vendor=str(device.get("vendor") or "").strip(),
-                    model=str(device.get("model") or "").strip(),
+                    vendor=vendor,
+                    model=model,
                     main_version=str(res.main_version),
                     device_changelog_md=info.get("changelog_md"),
                     device_released_at=info.get("released_at"),
                     device_checksum=info.get("checksum"),
                 )
+                if any(info.get(k) is not None for k in ("changelog_md", "released_at", "checksum")):
+                    self.invalidate_catalog_item(
+                        vendor=vendor,
+                        model=model,
+                        main_version=str(res.main_version),
+                    )
             except Exception:
                 pass
-
+        if res.success and res.main_version:
+            # docs are stored per snapshot, so they are copied even when the payload is unchanged
             try:
                 docs = _extract_inline_docs(res.payload if isinstance(res.payload, dict) else None)
                 for d in docs:
@@ -2455,13 +3128,31 @@ class App:
             except Exception:
                 pass
         controlled_changes: List[Dict[str, Any]] = []
+        # An unchanged payload cannot carry a changed controlled-file fingerprint, and once this
+        # process has checked it under the same rule there is no content left to capture. The rule
+        # is read on every poll: it may have been edited in another process, or a device edit may
+        # have moved the device under a different one.
         try:
-            controlled_changes = self._check_controlled_files(
-                device=device,
-                poll_result=res,
-                prev_success_snapshot=prev,
-                current_snapshot_id=snapshot_id,
+            rule = self.db.get_controlled_file_rule(
+                cluster_id=device["cluster_id"], vendor=device["vendor"], model=device["model"]
             )
+            checked = self._file_entries_cache.get(device_id)
+            if (
+                unchanged
+                and prev is not None
+                and checked is not None
+                and checked[0] == int(prev["id"])
+                and checked[3] == _controlled_rule_key(rule)
+            ):
+                self._file_entries_cache[device_id] = (int(snapshot_id), checked[1], checked[2], checked[3])
+            else:
+                controlled_changes = self._check_controlled_files(
+                    device=device,
+                    rule=rule,
+                    poll_result=res,
+                    prev_success_snapshot=prev,
+                    current_snapshot_id=snapshot_id,
+                )
         except Exception:
             controlled_changes = []
         old_state = device.get("last_state")
@@ -2470,35 +3161,37 @@ class App:
         )
         if new_state:
             self.db.update_device_state(device_id, new_state)
+        # (create_event kwargs, webhook payload) pairs, written in one transaction below
+        events: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
         if new_state and (old_state != new_state):
-            event_id = self.db.create_event(
-                device_id=device_id,
-                event_type="state_change",
-                old_state=str(old_state) if old_state is not None else None,
-                new_state=new_state,
-                message=message,
-                payload={
-                    "device_id": device_id,
-                    "device_serial": device.get("device_key"),
-                    "supplier": device.get("vendor"),
-                    "device_type": device.get("model"),
-                    "ip": device.get("ip"),
-                    "port": device.get("port"),
-                    "observed_main_version": res.main_version,
-                        "http_status": res.http_status,
-                        "error": res.error,
-                        "controlled_files_changed": len(controlled_changes),
+            events.append(
+                (
+                    {
+                        "device_id": device_id,
+                        "event_type": "state_change",
+                        "old_state": str(old_state) if old_state is not None else None,
+                        "new_state": new_state,
+                        "message": message,
+                        "payload": {
+                            "device_id": device_id,
+                            "device_serial": device.get("device_key"),
+                            "supplier": device.get("vendor"),
+                            "device_type": device.get("model"),
+                            "ip": device.get("ip"),
+                            "port": device.get("port"),
+                            "observed_main_version": res.main_version,
+                            "http_status": res.http_status,
+                            "error": res.error,
+                            "controlled_files_changed": len(controlled_changes),
+                        },
+                    },
+                    {
+                        "event_type": "state_change",
+                        "old_state": old_state,
+                        "new_state": new_state,
+                        "message": message,
                     },
                 )
-            self._notify_webhook(
-                {
-                    "event_id": event_id,
-                    "event_type": "state_change",
-                    "old_state": old_state,
-                    "new_state": new_state,
-                    "message": message,
-                    "timestamp": _utc_now_iso(),
-                }
             )
         if res.success and res.main_version:
             new_main = str(res.main_version)
@@ -2506,38 +3199,48 @@ class App:
                 event_type = "version_observed" if prev_main is None else "version_change"
                 cat = None
                 try:
-                    cat = self.db.get_version_catalog_item(
-                        vendor=str(device.get("vendor") or "").strip(),
-                        model=str(device.get("model") or "").strip(),
+                    cat = self.catalog_item(
+                        vendor=vendor,
+                        model=model,
                         main_version=new_main,
                     )
                 except Exception:
                     cat = None
-                event_id = self.db.create_event(
-                    device_id=device_id,
-                    event_type=event_type,
-                    old_state=prev_main,
-                    new_state=new_main,
-                    message=f"{event_type} {prev_main or ''} -> {new_main}".strip(),
-                    payload={
-                        "device_id": device_id,
-                        "device_serial": device.get("device_key"),
-                        "supplier": device.get("vendor"),
-                        "device_type": device.get("model"),
-                        "old_main_version": prev_main,
-                        "new_main_version": new_main,
-                        "version_catalog": cat,
-                    },
-                )
-                self._notify_webhook(
-                    {
-                        "event_id": event_id,
-                        "event_type": event_type,
-                        "old_main_version": prev_main,
-                        "new_main_version": new_main,
-                        "timestamp": _utc_now_iso(),
-                    }
+                events.append(
+                    (
+                        {
+                            "device_id": device_id,
+                            "event_type": event_type,
+                            "old_state": prev_main,
+                            "new_state": new_main,
+                            "message": f"{event_type} {prev_main or ''} -> {new_main}".strip(),
+                            "payload": {
+                                "device_id": device_id,
+                                "device_serial": device.get("device_key"),
+                                "supplier": device.get("vendor"),
+                                "device_type": device.get("model"),
+                                "old_main_version": prev_main,
+                                "new_main_version": new_main,
+                                "version_catalog": cat,
+                            },
+                        },
+                        {
+                            "event_type": event_type,
+                            "old_main_version": prev_main,
+                            "new_main_version": new_main,
+                        },
+                    )
                 )
+        if events:
+            event_ids = self.db.create_events_bulk([e for e, _ in events])
+            if self._has_event_listeners():
+                now = _utc_now_iso()
+                for event_id, (_, notify) in zip(event_ids, events):
+                    self._emit_event(device_id, {"event_id": event_id, **notify, "timestamp": now})
+        self._schedule_next_poll(
+            device_id,
+            quiet=unchanged and not controlled_changes and (not new_state or old_state == new_state),
+        )
         return {
             "device_id": device_id,
             "snapshot_id": snapshot_id,
@@ -2558,9 +3261,7 @@ class App:
         if not getattr(poll_result, "success", False):
             return "offline", str(getattr(poll_result, "error", None) or "offline")
         baseline = self.db.get_baseline(
-            cluster_id=int(device["cluster_id"]),
-            vendor=str(device["vendor"]),
-            model=str(device["model"]),
+            cluster_id=device["cluster_id"], vendor=device["vendor"], model=device["model"]
         )
         observed = str(getattr(poll_result, "main_version", None) or "")
         if baseline is None:
@@ -2577,53 +3278,204 @@ class App:
         expected = str(baseline.get("expected_main_version") or "")
         return "mismatch", f"mismatch expected={expected} observed={observed}"
 
+    def _has_event_listeners(self) -> bool:
+        """False when no webhook is configured and no dashboard is streaming: skip building notifications."""
+        return self.webhook_enabled or self.events.has_subscribers()
+
+    def _emit_event(self, device_id: int, payload: Dict[str, Any]) -> None:
+        self.events.publish({**payload, "device_id": device_id})
+        self._notify_webhook(payload)
+
     def _notify_webhook(self, payload: Dict[str, Any]) -> None:
-        if not self.webhook_url:
+        if not self.webhook_enabled:
             return
-
-        def send() -> None:
-            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-            req = urllib.request.Request(
-                self.webhook_url,
-                method="POST",
-                data=data,
-                headers={"Content-Type": "application/json; charset=utf-8"},
+        with self._webhook_lock:
+            if self._webhook_thread is None:
+                self._webhook_thread = threading.Thread(target=self._webhook_loop, name="vm-webhook", daemon=True)
+                self._webhook_thread.start()
+        try:
+            self._webhook_queue.put_nowait(payload)
+        except queue.Full:
+            # receiver unreachable for a long time; drop rather than grow without bound
+            pass
+
+    def _webhook_loop(self) -> None:
+        """Deliver queued events one POST each, in order; replaces a thread per event.
+
+        The connection to the receiver is kept open between events, so a burst costs one
+        TCP (and TLS) handshake instead of one per event.
+        """
+        url = urlparse(str(self.webhook_url))
+        conn_cls = {"http": http.client.HTTPConnection, "https": http.client.HTTPSConnection}.get(url.scheme)
+        target = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        try:
+            port = url.port
+        except ValueError as e:
+            conn_cls = None
+            reason = str(e)
+        else:
+            reason = "unsupported_scheme" if conn_cls is None else "missing_host"
+        if conn_cls is None or not url.hostname:
+            # a bad URL never becomes valid; stop queueing instead of dropping every event
+            self.webhook_enabled = False
+            print(
+                json.dumps({"webhook_error": f"invalid_webhook_url:{reason}"}, ensure_ascii=False),
+                file=sys.stderr,
+                flush=True,
             )
+            return
+        conn: Optional[http.client.HTTPConnection] = None
+        while True:
+            payload = self._webhook_queue.get()
             try:
-                urllib.request.urlopen(req, timeout=2.0).read()
-            except Exception:
-                return
-
-        threading.Thread(target=send, daemon=True).start()
+                data = _json_bytes(payload)
+            except Exception as e:  # noqa: BLE001
+                # skip the event rather than let one bad payload end the only sender thread
+                print(
+                    json.dumps({"webhook_error": f"unserializable_payload:{e}"}, ensure_ascii=False),
+                    file=sys.stderr,
+                    flush=True,
+                )
+                continue
+            while True:
+                reused = conn is not None
+                if conn is None:
+                    conn = conn_cls(url.hostname, port, timeout=2.0)
+                try:
+                    conn.request("POST", target, body=data, headers=headers)
+                    resp = conn.getresponse()
+                    resp.read()
+                except (ConnectionError, http.client.BadStatusLine):
+                    conn.close()
+                    conn = None
+                    if reused:
+                        # the receiver closed the idle connection; retry once on a new one
+                        continue
+                    break
+                except Exception:
+                    conn.close()
+                    conn = None
+                    break
+                if resp.will_close:
+                    conn.close()
+                    conn = None
+                break
+
+    def _schedule_next_poll(self, device_id: int, *, quiet: bool) -> None:
+        """Stretch the interval of a device that keeps answering the same payload; anything else resets it."""
+        if self.max_poll_interval_s <= self.poll_interval_s:
+            return
+        interval = self.poll_interval_s
+        if quiet:
+            prev = self._poll_backoff.get(device_id)
+            if prev is not None:
+                interval = min(self.max_poll_interval_s, prev[0] * 1.5)
+        self._poll_backoff[device_id] = (interval, time.monotonic() + interval)
+
+    def forget_device(self, device_id: int) -> None:
+        """Drop per-device state kept in memory once a device is edited or deleted."""
+        self._file_entries_cache.pop(int(device_id), None)
+        self._poll_backoff.pop(int(device_id), None)
+
+    def request_executor(self, kind: str) -> ThreadPoolExecutor:
+        """Return the persistent pool for `kind` ("poll" or "discover"), sized as the per-request pools were."""
+        with self._request_executor_lock:
+            ex = self._request_executors.get(kind)
+            if ex is None:
+                workers = max(1, int(self.poll_workers))
+                if kind == "discover":
+                    workers = min(workers, 32)
+                ex = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"vm-request-{kind}")
+                self._request_executors[kind] = ex
+            return ex
 
     def start_scheduler(self) -> None:
         if self.poll_interval_s <= 0:
             return
         if self._scheduler_thread and self._scheduler_thread.is_alive():
             return
+        if self._poll_executor is None:
+            self._poll_executor = ThreadPoolExecutor(max_workers=self.poll_workers, thread_name_prefix="vm-poll")
+        executor = self._poll_executor
+        # (monotonic due time, device id): every device is polled on its own schedule instead of all
+        # devices at once on a tick boundary. `scheduled` holds ids that are queued or being polled.
+        heap: List[Tuple[float, int]] = []
+        scheduled: Set[int] = set()
+        lock = threading.Lock()
+
+        def reschedule(device_id: int) -> None:
+            due = time.monotonic() + self.poll_interval_s
+            backoff = self._poll_backoff.get(device_id)
+            if backoff is not None:
+                due = max(due, backoff[1])
+            with lock:
+                heapq.heappush(heap, (due, device_id))
 
         def loop() -> None:
+            devices: Dict[int, Dict[str, Any]] = {}
+            first = True
+            next_refresh = 0.0
             while not self._stop_event.is_set():
-                try:
-                    devices = self.db.list_devices(enabled_only=True)
-                    with ThreadPoolExecutor(max_workers=self.poll_workers) as ex:
-                        futures = [ex.submit(self.poll_and_record, d, timeout_s=2.0) for d in devices]
-                        for f in as_completed(futures):
-                            try:
-                                f.result()
-                            except Exception:
-                                pass
-                finally:
-                    self._stop_event.wait(self.poll_interval_s)
+                now = time.monotonic()
+                if now >= next_refresh:
+                    # pick up added, edited, disabled and deleted devices once per interval
+                    try:
+                        devices = {int(d["id"]): d for d in self.db.list_devices(enabled_only=True)}
+                    except Exception:
+                        pass
+                    # disabled or deleted devices keep no backoff state
+                    for device_id in [i for i in list(self._poll_backoff) if i not in devices]:
+                        self._poll_backoff.pop(device_id, None)
+                    with lock:
+                        for device_id in devices:
+                            if device_id not in scheduled:
+                                scheduled.add(device_id)
+                                # spread the very first round over one interval
+                                due = now + random.uniform(0.0, self.poll_interval_s) if first else now
+                                heapq.heappush(heap, (due, device_id))
+                    first = False
+                    next_refresh = now + self.poll_interval_s
+                due_ids: List[int] = []
+                with lock:
+                    while heap and heap[0][0] <= now:
+                        _, device_id = heapq.heappop(heap)
+                        if device_id in devices:
+                            due_ids.append(device_id)
+                        else:
+                            scheduled.discard(device_id)
+                    wake = min(heap[0][0], next_refresh) if heap else next_refresh
+                for device_id in due_ids:
+                    try:
+                        fut = executor.submit(self.poll_and_record, devices[device_id], timeout_s=2.0)
+                    except RuntimeError:
+                        return  # executor shut down by stop_scheduler
+                    fut.add_done_callback(lambda _f, device_id=device_id: reschedule(device_id))
+                self._stop_event.wait(max(0.0, wake - time.monotonic()))
 
         self._scheduler_thread = threading.Thread(target=loop, daemon=True)
         self._scheduler_thread.start()
 
     def stop_scheduler(self) -> None:
         self._stop_event.set()
+        if self._poll_executor is not None:
+            self._poll_executor.shutdown(wait=False, cancel_futures=True)
+            self._poll_executor = None
+        with self._request_executor_lock:
+            for ex in self._request_executors.values():
+                ex.shutdown(wait=False, cancel_futures=True)
+            self._request_executors.clear()
+        if self._diff_executor is not None:
+            self._diff_executor.shutdown(wait=False, cancel_futures=True)
 
 class VersionManagerHandler(BaseHTTPRequestHandler):
     server_version = "VersionManager/0.1"
+    # Keep-alive: the dashboard's polling requests reuse one connection. Every response carries a
+    # Content-Length, and the two streamed ones (events, discover) close the connection themselves.
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are dropped after this long instead of holding a worker thread.
+    timeout = 60
+    _body_read = False
 
     def log_message(self, format: str, *args: Any) -> None:  # noqa: A003
         return
@@ -2644,39 +3496,36 @@ class VersionManagerHandler(BaseHTTPRequestHandler):
         if not (candidate == dist_abs or candidate.startswith(dist_abs + os.sep)):
             return False
         if os.path.isfile(candidate):
-            try:
-                data = open(candidate, "rb").read()
-            except Exception:
+            hit = self.app.read_static(candidate)
+            if hit is None:
                 return False
-            _send_bytes(self, 200, data=data, content_type=_guess_content_type(candidate))
+            _send_bytes(self, 200, data=hit[0], content_type=_guess_content_type(candidate), gz=hit[1])
             return True
         # SPA fallback
         index = os.path.join(dist_abs, "index.html")
         if os.path.isfile(index):
-            try:
-                data = open(index, "rb").read()
-            except Exception:
+            hit = self.app.read_static(index)
+            if hit is None:
                 return False
-            _send_bytes(self, 200, data=data, content_type=_guess_content_type(index))
+            _send_bytes(self, 200, data=hit[0], content_type=_guess_content_type(index), gz=hit[1])
             return True
         return False
 
     def _auth(self) -> Optional[Dict[str, Any]]:
         # API token bypass (admin)
-        if self.app.api_token:
+        if self.app.api_token_bytes:
             hdr = self.headers.get("X-Api-Token")
-            if hdr and secrets.compare_digest(hdr, self.app.api_token):
+            if hdr and secrets.compare_digest(hdr.encode("latin-1"), self.app.api_token_bytes):
                 return {"username": "api-token", "role": "admin"}
-        cookies = _parse_cookie(self.headers.get("Cookie"))
-        tok = cookies.get("vm_session")
+        tok = _cookie_value(self.headers.get("Cookie"), "vm_session")
         if not tok:
             return None
-        return self.app.db.get_session_user(token=tok)
+        return self.app.session_user(tok)
 
     def _require_login(self) -> Optional[Dict[str, Any]]:
         u = self._auth()
         if not u:
-            _send_json(self, 401, {"error": "unauthorized"})
+            _send_error(self, 401, "unauthorized")
             return None
         return u
 
@@ -2685,512 +3534,651 @@ class VersionManagerHandler(BaseHTTPRequestHandler):
         if not u:
             return None
         if str(u.get("role")) != "admin":
-            _send_json(self, 403, {"error": "forbidden"})
+            _send_error(self, 403, "forbidden")
             return None
         return u
 
-    def do_GET(self) -> None:  # noqa: N802
-        parsed = urlparse(self.path)
-        parts = _path_parts(parsed.path)
-        qs = parse_qs(parsed.query)
+    def _stream_events(self) -> None:
+        """Server-Sent Events: one "device_update" message per device event until the client leaves."""
+        q = self.app.events.subscribe()
+        self.close_connection = True
+        try:
+            # No Content-Length: the body is open-ended, so the shared response helpers don't apply.
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("X-Accel-Buffering", "no")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(b"retry: 5000\n\n")
+            while not self.app._stop_event.is_set():
+                try:
+                    data = q.get(timeout=_SSE_HEARTBEAT_S)
+                except queue.Empty:
+                    self.wfile.write(b": ping\n\n")
+                else:
+                    self.wfile.write(b"event: device_update\ndata: " + data + b"\n\n")
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            self.app.events.unsubscribe(q)
+
+    def _get_healthz(self, parts: List[str], query: str) -> None:
+        return _send_json_bytes(self, 200, _HEALTHZ_BODY, _HEALTHZ_LENGTH)
+
+    def _get_info(self, parts: List[str], query: str) -> None:
+        return _send_json(
+            self,
+            200,
+            {
+                "service": "version-manager",
+                "version": "0.1",
+                "cwd": os.getcwd(),
+                "db_path": os.path.abspath(self.app.db.db_path),
+                "timestamp": _utc_now_iso(),
+            },
+        )
 
-        if parsed.path == "/api/v1/healthz":
-            return _send_json(self, 200, {"ok": True})
+    def _get_login_page(self, parts: List[str], query: str) -> None:
+        if self._auth():
+            return _redirect(self, "/")
+        data, gz = _LOGIN_PAGES[not self.app.db.has_any_user()]
+        return _send_bytes(self, 200, data=data, content_type="text/html; charset=utf-8", gz=gz)
+
+    def _get_setup_page(self, parts: List[str], query: str) -> None:
+        if self.app.db.has_any_user():
+            return _send_error(self, 404, "not_found")
+        return _send_bytes(
+            self, 200, data=_SETUP_PAGE_BYTES, content_type="text/html; charset=utf-8", gz=_SETUP_PAGE_GZ
+        )
 
-        if parsed.path == "/api/v1/info":
-            return _send_json(
-                self,
-                200,
-                {
-                    "service": "version-manager",
-                    "version": "0.1",
-                    "cwd": os.getcwd(),
-                    "db_path": os.path.abspath(self.app.db.db_path),
-                    "timestamp": _utc_now_iso(),
-                },
-            )
+    def _get_legacy_page(self, parts: List[str], query: str) -> None:
+        if not self._auth():
+            return _redirect(self, "/login")
+        return _redirect(self, "/")
 
-        if parsed.path == "/login":
-            if self._auth():
-                return _redirect(self, "/")
-            return _send_html(self, 200, _login_html(setup_needed=not self.app.db.has_any_user()))
+    def _get_index(self, parts: List[str], query: str) -> None:
+        if not self._auth():
+            return _redirect(self, "/login")
+        if self._try_serve_frontend("/"):
+            return
+        return _send_bytes(
+            self, 200, data=_FRONTEND_MISSING_BYTES, content_type="text/html; charset=utf-8", gz=_FRONTEND_MISSING_GZ
+        )
 
-        if parsed.path == "/setup":
-            if self.app.db.has_any_user():
-                return _send_json(self, 404, {"error": "not_found"})
-            return _send_html(self, 200, _setup_html())
+    def _get_clusters(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        return _send_json_list(self, {"items": self.app.db.list_clusters()})
 
-        if parsed.path == "/legacy":
-            if not self._auth():
-                return _redirect(self, "/login")
-            return _redirect(self, "/")
+    def _get_devices(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        qs = parse_qs(query)
+        cluster_id = qs.get("cluster_id", [None])[0]
+        enabled_only = (qs.get("enabled_only", ["0"])[0] or "0") in ("1", "true", "True")
+        items = [
+            _present_device(x)
+            for x in self.app.db.list_devices(
+                cluster_id=int(cluster_id) if cluster_id else None, enabled_only=enabled_only
+            )
+        ]
+        return _send_json_list(self, {"items": items})
 
-        if parsed.path == "/":
-            if not self._auth():
-                return _redirect(self, "/login")
-            if self._try_serve_frontend(parsed.path):
-                return
-            return _send_html(self, 200, _frontend_missing_html())
+    def _get_device_snapshots(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        try:
+            device_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_device_id")
+        if not self.app.db.get_device(device_id):
+            return _send_error(self, 404, "not_found")
+        qs = parse_qs(query)
+        limit = qs.get("limit", ["50"])[0]
+        offset = qs.get("offset", ["0"])[0]
+        success_only = (qs.get("success_only", ["0"])[0] or "0") in ("1", "true", "True")
+        try:
+            lim = int(limit) if limit else 50
+            off = int(offset) if offset else 0
+        except Exception:
+            lim, off = 50, 0
+        items = self.app.db.list_device_snapshots(device_id=device_id, limit=lim, offset=off, success_only=success_only)
+        return _send_json(self, 200, {"items": items})
 
-        # Serve Vue frontend static assets / SPA routes (when built dist exists).
-        if not parsed.path.startswith("/api/") and self.app.frontend_dist:
-            if not self._auth():
-                return _redirect(self, "/login")
-            if self._try_serve_frontend(parsed.path):
-                return
-
-        if parts[:3] == ["api", "v1", "clusters"] and len(parts) == 3:
-            if not self._require_login():
-                return
-            return _send_json(self, 200, {"items": self.app.db.list_clusters()})
-
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 3:
-            if not self._require_login():
-                return
-            cluster_id = qs.get("cluster_id", [None])[0]
-            enabled_only = (qs.get("enabled_only", ["0"])[0] or "0") in ("1", "true", "True")
-            items = [
-                _present_device(x)
-                for x in self.app.db.list_devices(
-                    cluster_id=int(cluster_id) if cluster_id else None, enabled_only=enabled_only
-                )
-            ]
-            return _send_json(self, 200, {"items": items})
-
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 5 and parts[4] == "snapshots":
-            if not self._require_login():
-                return
-            try:
-                device_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_device_id"})
-            if not self.app.db.get_device(device_id):
-                return _send_json(self, 404, {"error": "not_found"})
-            limit = qs.get("limit", ["50"])[0]
-            offset = qs.get("offset", ["0"])[0]
-            success_only = (qs.get("success_only", ["0"])[0] or "0") in ("1", "true", "True")
-            try:
-                lim = int(limit) if limit else 50
-                off = int(offset) if offset else 0
-            except Exception:
-                lim, off = 50, 0
-            items = self.app.db.list_device_snapshots(device_id=device_id, limit=lim, offset=off, success_only=success_only)
-            return _send_json(self, 200, {"items": items})
+    def _get_device_version_history(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        try:
+            device_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_device_id")
+        if not self.app.db.get_device(device_id):
+            return _send_error(self, 404, "not_found")
+        qs = parse_qs(query)
+        limit = qs.get("limit", ["200"])[0]
+        try:
+            lim = int(limit) if limit else 200
+        except Exception:
+            lim = 200
+        items = self.app.db.list_device_version_history(device_id=device_id, limit=lim)
+        return _send_json(self, 200, {"items": items})
 
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 5 and parts[4] == "version-history":
-            if not self._require_login():
-                return
-            try:
-                device_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_device_id"})
-            if not self.app.db.get_device(device_id):
-                return _send_json(self, 404, {"error": "not_found"})
-            limit = qs.get("limit", ["200"])[0]
+    def _get_device_docs(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        try:
+            device_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_device_id")
+        if not self.app.db.get_device(device_id):
+            return _send_error(self, 404, "not_found")
+        qs = parse_qs(query)
+        snapshot_id = qs.get("snapshot_id", [None])[0]
+        snap_id = None
+        if snapshot_id:
             try:
-                lim = int(limit) if limit else 200
+                snap_id = int(snapshot_id)
             except Exception:
-                lim = 200
-            items = self.app.db.list_device_version_history(device_id=device_id, limit=lim)
-            return _send_json(self, 200, {"items": items})
-
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 5 and parts[4] == "docs":
-            if not self._require_login():
-                return
-            try:
-                device_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_device_id"})
-            if not self.app.db.get_device(device_id):
-                return _send_json(self, 404, {"error": "not_found"})
-            snapshot_id = qs.get("snapshot_id", [None])[0]
-            snap_id = None
-            if snapshot_id:
-                try:
-                    snap_id = int(snapshot_id)
-                except Exception:
-                    return _send_json(self, 400, {"error": "invalid_snapshot_id"})
-            if snap_id is None:
-                snap = self.app.db.get_latest_success_snapshot(device_id)
-                snap_id = int(snap["id"]) if snap and snap.get("id") is not None else None
-            if snap_id is None:
-                return _send_json(self, 200, {"snapshot_id": None, "items": []})
-            items = self.app.db.list_device_docs(device_id=device_id, snapshot_id=snap_id)
-            return _send_json(self, 200, {"snapshot_id": snap_id, "items": items})
-
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 4:
-            if not self._require_login():
-                return
-            try:
-                device_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_device_id"})
-            dev = self.app.db.get_device(device_id)
-            if not dev:
-                return _send_json(self, 404, {"error": "not_found"})
-            snap = self.app.db.get_latest_snapshot(device_id)
-            base = self.app.db.get_baseline(cluster_id=int(dev["cluster_id"]), vendor=str(dev["vendor"]), model=str(dev["model"]))
-            cfr = self.app.db.get_controlled_file_rule(
-                cluster_id=int(dev["cluster_id"]), vendor=str(dev["vendor"]), model=str(dev["model"])
-            )
+                return _send_error(self, 400, "invalid_snapshot_id")
+        if snap_id is None:
+            snap = self.app.db.get_latest_success_snapshot(device_id)
+            snap_id = int(snap["id"]) if snap and snap.get("id") is not None else None
+        if snap_id is None:
+            return _send_json(self, 200, {"snapshot_id": None, "items": []})
+        items = self.app.db.list_device_docs(device_id=device_id, snapshot_id=snap_id)
+        return _send_json(self, 200, {"snapshot_id": snap_id, "items": items})
+
+    def _get_device(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        try:
+            device_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_device_id")
+        bundle = self.app.db.get_device_detail_bundle(device_id)
+        if not bundle:
+            return _send_error(self, 404, "not_found")
+        dev = bundle["device"]
+        snap = bundle["latest_snapshot"]
+        base = bundle["baseline"]
+        cfr = bundle["controlled_file_rule"]
+        observed_catalog = None
+        expected_catalog = None
+        try:
+            vendor = dev["vendor"].strip()
+            model = dev["model"].strip()
+            if snap and snap.get("main_version"):
+                observed_catalog = _present_version_catalog_item(
+                    self.app.catalog_item(vendor=vendor, model=model, main_version=str(snap["main_version"]))
+                )
+            if base and base.get("expected_main_version"):
+                expected_catalog = _present_version_catalog_item(
+                    self.app.catalog_item(
+                        vendor=vendor, model=model, main_version=str(base["expected_main_version"])
+                    )
+                )
+        except Exception:
             observed_catalog = None
             expected_catalog = None
-            try:
-                vendor = str(dev.get("vendor") or "").strip()
-                model = str(dev.get("model") or "").strip()
-                if snap and snap.get("main_version"):
-                    observed_catalog = _present_version_catalog_item(
-                        self.app.db.get_version_catalog_item(vendor=vendor, model=model, main_version=str(snap["main_version"]))
-                    )
-                if base and base.get("expected_main_version"):
-                    expected_catalog = _present_version_catalog_item(
-                        self.app.db.get_version_catalog_item(
-                            vendor=vendor, model=model, main_version=str(base["expected_main_version"])
-                        )
-                    )
-            except Exception:
-                observed_catalog = None
-                expected_catalog = None
-            return _send_json(
-                self,
-                200,
-                {
-                    "device": _present_device(dev),
-                    "baseline": _present_baseline(base),
-                    "controlled_file_rule": _present_controlled_file_rule(cfr),
-                    "latest_snapshot": snap,
-                    "observed_version_catalog": observed_catalog,
-                    "expected_version_catalog": expected_catalog,
-                },
-            )
+        return _send_json(
+            self,
+            200,
+            {
+                "device": _present_device(dev),
+                "baseline": _present_baseline(base),
+                "controlled_file_rule": _present_controlled_file_rule(cfr),
+                "latest_snapshot": snap,
+                "observed_version_catalog": observed_catalog,
+                "expected_version_catalog": expected_catalog,
+            },
+        )
 
-        if parts[:3] == ["api", "v1", "baselines"] and len(parts) == 3:
-            if not self._require_login():
-                return
-            cluster_id = qs.get("cluster_id", [None])[0]
-            items = [_present_baseline(x) for x in self.app.db.list_baselines(cluster_id=int(cluster_id) if cluster_id else None)]
-            return _send_json(self, 200, {"items": items})
+    def _get_baselines(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        qs = parse_qs(query)
+        cluster_id = qs.get("cluster_id", [None])[0]
+        items = [_present_baseline(x) for x in self.app.db.list_baselines(cluster_id=int(cluster_id) if cluster_id else None)]
+        return _send_json_list(self, {"items": items})
 
-        if parts[:3] == ["api", "v1", "controlled-file-rules"] and len(parts) == 3:
-            if not self._require_login():
-                return
-            cluster_id = qs.get("cluster_id", [None])[0]
-            items = [
-                _present_controlled_file_rule(x)
-                for x in self.app.db.list_controlled_file_rules(cluster_id=int(cluster_id) if cluster_id else None)
-            ]
-            return _send_json(self, 200, {"items": items})
-
-        if parts[:3] == ["api", "v1", "version-catalog"] and len(parts) == 3:
-            if not self._require_login():
-                return
-            supplier = qs.get("supplier", [None])[0]
-            device_type = qs.get("device_type", [None])[0]
-            items = [
-                _present_version_catalog_item(x)
-                for x in self.app.db.list_version_catalog(vendor=supplier, model=device_type)
-            ]
-            return _send_json(self, 200, {"items": items})
-
-        if parts[:3] == ["api", "v1", "events"] and len(parts) == 3:
-            if not self._require_login():
-                return
-            limit = qs.get("limit", ["50"])[0]
-            device_id = qs.get("device_id", [None])[0]
+    def _get_controlled_file_rules(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        qs = parse_qs(query)
+        cluster_id = qs.get("cluster_id", [None])[0]
+        items = [
+            _present_controlled_file_rule(x)
+            for x in self.app.db.list_controlled_file_rules(cluster_id=int(cluster_id) if cluster_id else None)
+        ]
+        return _send_json_list(self, {"items": items})
+
+    def _get_version_catalog(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        qs = parse_qs(query)
+        supplier = qs.get("supplier", [None])[0]
+        device_type = qs.get("device_type", [None])[0]
+        items = [
+            _present_version_catalog_item(x)
+            for x in self.app.db.list_version_catalog(vendor=supplier, model=device_type)
+        ]
+        return _send_json_list(self, {"items": items})
+
+    def _get_events_stream(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        return self._stream_events()
+
+    def _get_events(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        qs = parse_qs(query)
+        limit = qs.get("limit", ["50"])[0]
+        device_id = qs.get("device_id", [None])[0]
+        try:
+            lim = int(limit) if limit else 50
+        except Exception:
+            lim = 50
+        did = None
+        if device_id:
             try:
-                lim = int(limit) if limit else 50
+                did = int(device_id)
             except Exception:
-                lim = 50
-            did = None
-            if device_id:
-                try:
-                    did = int(device_id)
-                except Exception:
-                    return _send_json(self, 400, {"error": "invalid_device_id"})
-            items = self.app.db.list_events(limit=lim, device_id=did)
-            return _send_json(self, 200, {"items": items, "timestamp": _utc_now_iso()})
+                return _send_error(self, 400, "invalid_device_id")
+        items = self.app.db.list_events(limit=lim, device_id=did)
+        return _send_json(self, 200, {"items": items, "timestamp": _utc_now_iso()})
 
-        if parts[:3] == ["api", "v1", "status"] and len(parts) == 3:
-            if not self._require_login():
-                return
-            rows = self.app.db.list_status()
-            out: List[Dict[str, Any]] = []
-            for r in rows:
-                rr = dict(r)
-                rr["device"] = _present_device(rr.get("device"))
-                rr["baseline"] = _present_baseline(rr.get("baseline"))
-                out.append(rr)
-            return _send_json(self, 200, {"items": out, "timestamp": _utc_now_iso()})
-
-        if parsed.path == "/api/v1/me":
-            u = self._auth()
-            if not u:
-                return _send_json(self, 401, {"error": "unauthorized"})
-            return _send_json(self, 200, {"user": u})
+    def _get_status(self, parts: List[str], query: str) -> None:
+        if not self._require_login():
+            return
+        data, etag = self.app.status_body()
+        return _send_json_bytes(self, 200, data, etag=etag)
 
-        return _send_json(self, 404, {"error": "not_found"})
+    def _get_me(self, parts: List[str], query: str) -> None:
+        u = self._auth()
+        if not u:
+            return _send_error(self, 401, "unauthorized")
+        return _send_json(self, 200, {"user": u})
+
+    # Exact-path GET routes, then /api/v1/<resource>[/<id>[/<sub>]] routes keyed by
+    # (resource, segment count, sub-resource): one dict lookup per request instead of an if-chain.
+    _GET_EXACT: Dict[str, Callable[..., None]] = {
+        "/api/v1/healthz": _get_healthz,
+        "/api/v1/info": _get_info,
+        "/login": _get_login_page,
+        "/setup": _get_setup_page,
+        "/legacy": _get_legacy_page,
+        "/": _get_index,
+        "/api/v1/events/stream": _get_events_stream,
+        "/api/v1/me": _get_me,
+    }
+    _GET_ROUTES: Dict[Tuple[str, int, Optional[str]], Callable[..., None]] = {
+        ("clusters", 3, None): _get_clusters,
+        ("devices", 3, None): _get_devices,
+        ("devices", 5, "snapshots"): _get_device_snapshots,
+        ("devices", 5, "version-history"): _get_device_version_history,
+        ("devices", 5, "docs"): _get_device_docs,
+        ("devices", 4, None): _get_device,
+        ("baselines", 3, None): _get_baselines,
+        ("controlled-file-rules", 3, None): _get_controlled_file_rules,
+        ("version-catalog", 3, None): _get_version_catalog,
+        ("events", 3, None): _get_events,
+        ("status", 3, None): _get_status,
+    }
 
-    def do_POST(self) -> None:  # noqa: N802
+    def do_GET(self) -> None:  # noqa: N802
+        if self.headers.get("Content-Length") or self.headers.get("Transfer-Encoding"):
+            self.close_connection = True  # unexpected request body: do not read the next request after it
         parsed = urlparse(self.path)
         parts = _path_parts(parsed.path)
 
-        if parts[:3] == ["api", "v1", "setup"] and len(parts) == 3:
-            if self.app.db.has_any_user():
-                return _send_json(self, 409, {"error": "already_initialized"})
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            username = str(body.get("username") or "admin").strip()
-            password = str(body.get("password") or "")
-            if len(password) < 8:
-                return _send_json(self, 400, {"error": "password_too_short"})
-            try:
-                uid = self.app.db.create_user(username=username, password=password, role="admin")
-            except Exception as e:  # noqa: BLE001
-                return _send_json(self, 400, {"error": f"setup_failed:{e}"})
-            return _send_json(self, 201, {"ok": True, "user_id": uid})
+        route = self._GET_EXACT.get(parsed.path)
+        if route is not None:
+            return route(self, parts, parsed.query)
 
-        if parts[:3] == ["api", "v1", "login"] and len(parts) == 3:
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            username = str(body.get("username") or "").strip()
-            password = str(body.get("password") or "")
-            u = self.app.db.verify_user(username=username, password=password)
-            if not u:
-                return _send_json(self, 401, {"error": "invalid_credentials"})
-            token = self.app.db.create_session(user_id=int(u["id"]))
-            payload = {"ok": True, "user": {"username": u["username"], "role": u["role"]}}
-            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-            self.send_response(200)
-            _set_cookie(self, "vm_session", token, max_age=12 * 3600)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
-            return
+        # Serve Vue frontend static assets / SPA routes (when built dist exists).
+        if not parsed.path.startswith("/api/") and self.app.frontend_dist:
+            if not self._auth():
+                return _redirect(self, "/login")
+            if self._try_serve_frontend(parsed.path):
+                return
 
-        if parts[:3] == ["api", "v1", "logout"] and len(parts) == 3:
-            u = self._auth()
-            cookies = _parse_cookie(self.headers.get("Cookie"))
-            tok = cookies.get("vm_session")
-            if tok:
-                self.app.db.delete_session(token=tok)
-            payload = {"ok": True, "user": u}
-            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-            self.send_response(200)
-            _set_cookie(self, "vm_session", "", max_age=0)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
+        if len(parts) >= 3 and parts[0] == "api" and parts[1] == "v1":
+            route = self._GET_ROUTES.get((parts[2], len(parts), parts[4] if len(parts) > 4 else None))
+            if route is not None:
+                return route(self, parts, parsed.query)
+
+        return _send_error(self, 404, "not_found")
+
+    def _post_setup(self, parts: List[str]) -> None:
+        if self.app.db.has_any_user():
+            return _send_error(self, 409, "already_initialized")
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        username = str(body.get("username") or "admin").strip()
+        password = str(body.get("password") or "")
+        if len(password) < 8:
+            return _send_error(self, 400, "password_too_short")
+        try:
+            uid = self.app.db.create_user(username=username, password=password, role="admin")
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 400, {"error": f"setup_failed:{e}"})
+        return _send_json(self, 201, {"ok": True, "user_id": uid})
+
+    def _post_login(self, parts: List[str]) -> None:
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        username = str(body.get("username") or "").strip()
+        password = str(body.get("password") or "")
+        u = self.app.db.verify_user(username=username, password=password)
+        if not u:
+            return _send_error(self, 401, "invalid_credentials")
+        token = self.app.db.create_session(user_id=int(u["id"]))
+        payload = {"ok": True, "user": {"username": u["username"], "role": u["role"]}}
+        data = _json_bytes(payload)
+        cookie = _cookie_header("vm_session", token, max_age=12 * 3600)
+        return _write_response(self, 200, "application/json; charset=utf-8", data, (("Set-Cookie", cookie),))
+
+    def _post_logout(self, parts: List[str]) -> None:
+        u = self._auth()
+        tok = _cookie_value(self.headers.get("Cookie"), "vm_session")
+        if tok:
+            self.app.end_session(tok)
+        payload = {"ok": True, "user": u}
+        data = _json_bytes(payload)
+        cookie = _cookie_header("vm_session", "", max_age=0)
+        return _write_response(self, 200, "application/json; charset=utf-8", data, (("Set-Cookie", cookie),))
+
+    def _post_analyze_device(self, parts: List[str]) -> None:
+        if parts[3] != "device":
+            return _send_error(self, 404, "not_found")
+        if not self._require_admin():
             return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        try:
+            device_id = int(body.get("device_id"))
+        except Exception:
+            return _send_error(self, 400, "missing_or_invalid_device_id")
+        provider = str(body.get("provider") or "ollama").strip()
+        model = str(body.get("model") or "").strip()
+        if not model:
+            model = "qwen2.5:7b" if provider.lower() in ("ollama", "local") else "gpt-4o-mini"
+        include_docs = bool(body.get("include_docs", True))
+
+        timeout_raw = body.get("timeout_s")
+        if timeout_raw is None:
+            timeout_raw = str(os.environ.get("VM_AI_TIMEOUT_S", "")).strip() or None
+        try:
+            timeout_s = float(timeout_raw) if timeout_raw is not None else 120.0
+        except Exception:
+            timeout_s = 120.0
+        timeout_s = max(5.0, min(timeout_s, 600.0))
 
-        if parts[:3] == ["api", "v1", "analyze"] and len(parts) == 4 and parts[3] == "device":
+        max_tokens_raw = body.get("max_tokens")
+        if max_tokens_raw is None:
+            max_tokens_raw = str(os.environ.get("VM_AI_MAX_TOKENS", "")).strip() or None
+        try:
+            max_tokens = int(max_tokens_raw) if max_tokens_raw is not None else 1200
+        except Exception:
+            max_tokens = 1200
+        max_tokens = max(256, min(max_tokens, 8192))
+
+        dev = self.app.db.get_device(device_id)
+        if not dev:
+            return _send_error(self, 404, "device_not_found")
+        snap = self.app.db.get_latest_snapshot(device_id)
+        base = self.app.db.get_baseline(cluster_id=dev["cluster_id"], vendor=dev["vendor"], model=dev["model"])
+        vendor = dev["vendor"].strip()
+        model_key = dev["model"].strip()
+        observed_catalog = None
+        if snap and snap.get("main_version"):
+            observed_catalog = self.app.catalog_item(
+                vendor=vendor, model=model_key, main_version=str(snap.get("main_version") or "")
+            )
+        events = self.app.db.list_events(limit=50, device_id=device_id)
+        docs = []
+        docs_snapshot_id = None
+        if include_docs:
+            success_snap = self.app.db.get_latest_success_snapshot(device_id)
+            if success_snap and success_snap.get("id") is not None:
+                docs_snapshot_id = int(success_snap["id"])
+                docs = self.app.db.list_device_docs(device_id=device_id, snapshot_id=docs_snapshot_id)
+
+        context = {
+            "device": _present_device(dict(dev)),
+            "baseline": _present_baseline(dict(base)) if base else None,
+            "latest_snapshot": snap,
+            "observed_version_catalog": _present_version_catalog_item(observed_catalog) if observed_catalog else None,
+            "events": events,
+            "docs_snapshot_id": docs_snapshot_id,
+            "docs": docs,
+        }
+        try:
+            from .ai import AiNotAvailable, ModelError, analyze_version_state  # type: ignore
+
+            result = analyze_version_state(
+                context=context,
+                provider=provider,
+                model=model,
+                timeout_s=timeout_s,
+                max_tokens=max_tokens,
+            )
+        except AiNotAvailable as e:
+            return _send_error(self, 503, str(e))
+        except ModelError as e:
+            return _send_error(self, 502, str(e))
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 500, {"error": f"analysis_failed:{type(e).__name__}:{e}"})
+        return _send_json(self, 200, {"ok": True, "provider": provider, "model": model, "result": result})
+
+    def _post_register(self, parts: List[str]) -> None:
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+
+        required_token = self.app.registration_token
+        if required_token:
+            supplied = self.headers.get("X-Registration-Token") or str(body.get("registration_token") or "")
+            if supplied != required_token:
+                # allow admin user to register without registration token
+                u = self._auth()
+                if not u or str(u.get("role")) != "admin":
+                    return _send_error(self, 401, "invalid_registration_token")
+        else:
+            # no registration token => require admin
             if not self._require_admin():
                 return
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            try:
-                device_id = int(body.get("device_id"))
-            except Exception:
-                return _send_json(self, 400, {"error": "missing_or_invalid_device_id"})
-            provider = str(body.get("provider") or "ollama").strip()
-            model = str(body.get("model") or "").strip()
-            if not model:
-                model = "qwen2.5:7b" if provider.lower() in ("ollama", "local") else "gpt-4o-mini"
-            include_docs = bool(body.get("include_docs", True))
-
-            timeout_raw = body.get("timeout_s")
-            if timeout_raw is None:
-                timeout_raw = str(os.environ.get("VM_AI_TIMEOUT_S", "")).strip() or None
-            try:
-                timeout_s = float(timeout_raw) if timeout_raw is not None else 120.0
-            except Exception:
-                timeout_s = 120.0
-            timeout_s = max(5.0, min(timeout_s, 600.0))
 
-            max_tokens_raw = body.get("max_tokens")
-            if max_tokens_raw is None:
-                max_tokens_raw = str(os.environ.get("VM_AI_MAX_TOKENS", "")).strip() or None
-            try:
-                max_tokens = int(max_tokens_raw) if max_tokens_raw is not None else 1200
-            except Exception:
-                max_tokens = 1200
-            max_tokens = max(256, min(max_tokens, 8192))
-
-            dev = self.app.db.get_device(device_id)
-            if not dev:
-                return _send_json(self, 404, {"error": "device_not_found"})
-            snap = self.app.db.get_latest_snapshot(device_id)
-            base = self.app.db.get_baseline(
-                cluster_id=int(dev["cluster_id"]), vendor=str(dev["vendor"]), model=str(dev["model"])
-            )
-            vendor = str(dev.get("vendor") or "").strip()
-            model_key = str(dev.get("model") or "").strip()
-            observed_catalog = None
-            if snap and snap.get("main_version"):
-                observed_catalog = self.app.db.get_version_catalog_item(
-                    vendor=vendor, model=model_key, main_version=str(snap.get("main_version") or "")
-                )
-            events = self.app.db.list_events(limit=50, device_id=device_id)
-            docs = []
-            docs_snapshot_id = None
-            if include_docs:
-                success_snap = self.app.db.get_latest_success_snapshot(device_id)
-                if success_snap and success_snap.get("id") is not None:
-                    docs_snapshot_id = int(success_snap["id"])
-                    docs = self.app.db.list_device_docs(device_id=device_id, snapshot_id=docs_snapshot_id)
-
-            context = {
-                "device": _present_device(dict(dev)),
-                "baseline": _present_baseline(dict(base)) if base else None,
-                "latest_snapshot": snap,
-                "observed_version_catalog": _present_version_catalog_item(observed_catalog) if observed_catalog else None,
-                "events": events,
-                "docs_snapshot_id": docs_snapshot_id,
-                "docs": docs,
+        cluster_id: Optional[int] = None
+        cluster_obj = body.get("cluster") or {}
+        if isinstance(cluster_obj, dict):
+            if cluster_obj.get("id") is not None:
+                try:
+                    cluster_id = int(cluster_obj.get("id"))
+                except Exception:
+                    return _send_error(self, 400, "invalid_cluster_id")
+            elif cluster_obj.get("name"):
+                name = str(cluster_obj.get("name") or "").strip()
+                c = self.app.db.get_cluster_by_name(name) if name else None
+                if not c:
+                    return _send_error(self, 404, "cluster_not_found")
+                cluster_id = int(c["id"])
+
+        if cluster_id is None:
+            if self.app.default_cluster_id is not None:
+                cluster_id = int(self.app.default_cluster_id)
+            else:
+                return _send_error(self, 400, "missing_cluster")
+
+        if not self.app.db.get_cluster(int(cluster_id)):
+            return _send_error(self, 404, "cluster_not_found")
+
+        device_serial = _get_body_str(body, "device_serial").strip()
+        supplier = _get_body_str(body, "supplier").strip()
+        device_type = _get_body_str(body, "device_type").strip()
+        device_key_prefix = str(body.get("device_key_prefix") or "").strip()
+        line_no = body.get("line_no")
+
+        auth_obj = body.get("auth") or {"type": "none"}
+        auth_type = str(auth_obj.get("type") or "none").strip()
+        auth_token = auth_obj.get("token")
+
+        protocol = "dvp1-http"
+        ip = str(body.get("ip") or "").strip()
+        port = int(body.get("port") or 80)
+        path = str(body.get("path") or "/.well-known/device-version").strip()
+
+        dvp_url = body.get("dvp_url")
+        if isinstance(dvp_url, str) and dvp_url.strip():
+            parsed_url = _parse_dvp_url(dvp_url.strip())
+            if not parsed_url:
+                return _send_error(self, 400, "invalid_dvp_url")
+            ip = parsed_url["ip"]
+            port = int(parsed_url["port"])
+            path = parsed_url["path"]
+            protocol = parsed_url["protocol"]
+
+        prefer_remote_ip = bool(body.get("prefer_remote_ip", False))
+        if prefer_remote_ip or not ip:
+            ip = str(self.client_address[0])
+
+        verify = bool(body.get("verify", True))
+        timeout_s = float(body.get("timeout_s") or 1.5)
+
+        pre_poll_payload: Optional[Dict[str, Any]] = None
+        pre_poll_result: Optional[Dict[str, Any]] = None
+        if not device_serial or not supplier or not device_type:
+            probe_dev = {
+                "ip": ip,
+                "port": port,
+                "protocol": protocol,
+                "path": path,
+                "auth_type": auth_type,
+                "auth_token": auth_token,
             }
-            try:
-                from .ai import AiNotAvailable, ModelError, analyze_version_state  # type: ignore
+            res = poll_device(probe_dev, timeout_s=timeout_s)
+            pre_poll_result = {
+                "success": res.success,
+                "http_status": res.http_status,
+                "latency_ms": res.latency_ms,
+                "error": res.error,
+                "main_version": res.main_version,
+            }
+            if res.success and isinstance(res.payload, dict):
+                pre_poll_payload = res.payload
+                inferred = _infer_from_dvp(res.payload)
+                if not supplier and inferred.get("supplier"):
+                    supplier = inferred["supplier"]
+                if not device_type and inferred.get("device_type"):
+                    device_type = inferred["device_type"]
+                if not device_serial and inferred.get("device_serial"):
+                    device_serial = device_key_prefix + inferred["device_serial"]
+
+        if not device_serial or not supplier or not device_type:
+            return _send_json(
+                self,
+                400,
+                {
+                    "error": "missing_fields",
+                    "required": ["device_serial", "supplier", "device_type"],
+                    "hint": "provide dvp_url (or ip/port/path) and let server infer fields, or provide fields directly",
+                    "pre_poll": pre_poll_result,
+                },
+            )
 
-                result = analyze_version_state(
-                    context=context,
-                    provider=provider,
-                    model=model,
-                    timeout_s=timeout_s,
-                    max_tokens=max_tokens,
-                )
-            except AiNotAvailable as e:
-                return _send_json(self, 503, {"error": str(e)})
-            except ModelError as e:
-                return _send_json(self, 502, {"error": str(e)})
-            except Exception as e:  # noqa: BLE001
-                return _send_json(self, 500, {"error": f"analysis_failed:{type(e).__name__}:{e}"})
-            return _send_json(self, 200, {"ok": True, "provider": provider, "model": model, "result": result})
+        device_id, action, dev = self.app.db.upsert_device_by_key(
+            cluster_id=int(cluster_id),
+            device_key=device_serial,
+            vendor=supplier,
+            model=device_type,
+            line_no=str(line_no).strip() if line_no is not None else None,
+            ip=ip,
+            port=port,
+            protocol=protocol,
+            path=path,
+            auth=DeviceAuth(type=auth_type, token=auth_token),
+            enabled=True,
+        )
 
-        if parts[:3] == ["api", "v1", "register"] and len(parts) == 3:
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-
-            required_token = self.app.registration_token
-            if required_token:
-                supplied = self.headers.get("X-Registration-Token") or str(body.get("registration_token") or "")
-                if supplied != required_token:
-                    # allow admin user to register without registration token
-                    u = self._auth()
-                    if not u or str(u.get("role")) != "admin":
-                        return _send_json(self, 401, {"error": "invalid_registration_token"})
+        verification: Optional[Dict[str, Any]] = None
+        if verify:
+            if pre_poll_payload is not None and pre_poll_result is not None:
+                self.app.db.record_snapshot(
+                    device_id=int(device_id),
+                    success=True,
+                    http_status=pre_poll_result.get("http_status"),
+                    latency_ms=pre_poll_result.get("latency_ms"),
+                    error=None,
+                    protocol_version=1,
+                    main_version=pre_poll_result.get("main_version"),
+                    firmware_version=None,
+                    payload=pre_poll_payload,
+                )
+                verification = pre_poll_result
             else:
-                # no registration token => require admin
-                if not self._require_admin():
-                    return
+                verification = self.app.poll_and_record(dev, timeout_s=timeout_s)
 
-            cluster_id: Optional[int] = None
-            cluster_obj = body.get("cluster") or {}
-            if isinstance(cluster_obj, dict):
-                if cluster_obj.get("id") is not None:
-                    try:
-                        cluster_id = int(cluster_obj.get("id"))
-                    except Exception:
-                        return _send_json(self, 400, {"error": "invalid_cluster_id"})
-                elif cluster_obj.get("name"):
-                    name = str(cluster_obj.get("name") or "").strip()
-                    c = self.app.db.get_cluster_by_name(name) if name else None
-                    if not c:
-                        return _send_json(self, 404, {"error": "cluster_not_found"})
-                    cluster_id = int(c["id"])
-
-            if cluster_id is None:
-                if self.app.default_cluster_id is not None:
-                    cluster_id = int(self.app.default_cluster_id)
-                else:
-                    return _send_json(self, 400, {"error": "missing_cluster"})
+        return _send_json(
+            self,
+            200,
+            {"device_id": device_id, "action": action, "ip": ip, "port": port, "path": path, "verification": verification},
+        )
 
-            if not self.app.db.get_cluster(int(cluster_id)):
-                return _send_json(self, 404, {"error": "cluster_not_found"})
+    def _post_clusters(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        name = str(body.get("name") or "").strip()
+        if not name:
+            return _send_error(self, 400, "missing_name")
+        description = body.get("description")
+        try:
+            cluster_id = self.app.db.create_cluster(name=name, description=description)
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 409, {"error": f"create_cluster_failed:{e}"})
+        return _send_json(self, 201, {"id": cluster_id})
 
+    def _post_devices(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        try:
+            cluster_id = int(body.get("cluster_id"))
             device_serial = _get_body_str(body, "device_serial").strip()
             supplier = _get_body_str(body, "supplier").strip()
             device_type = _get_body_str(body, "device_type").strip()
-            device_key_prefix = str(body.get("device_key_prefix") or "").strip()
             line_no = body.get("line_no")
-
-            auth_obj = body.get("auth") or {"type": "none"}
-            auth_type = str(auth_obj.get("type") or "none").strip()
-            auth_token = auth_obj.get("token")
-
-            protocol = "dvp1-http"
             ip = str(body.get("ip") or "").strip()
             port = int(body.get("port") or 80)
+            protocol = str(body.get("protocol") or "dvp1-http").strip()
             path = str(body.get("path") or "/.well-known/device-version").strip()
-
-            dvp_url = body.get("dvp_url")
-            if isinstance(dvp_url, str) and dvp_url.strip():
-                parsed_url = _parse_dvp_url(dvp_url.strip())
-                if not parsed_url:
-                    return _send_json(self, 400, {"error": "invalid_dvp_url"})
-                ip = parsed_url["ip"]
-                port = int(parsed_url["port"])
-                path = parsed_url["path"]
-                protocol = parsed_url["protocol"]
-
-            prefer_remote_ip = bool(body.get("prefer_remote_ip", False))
-            if prefer_remote_ip or not ip:
-                ip = str(self.client_address[0])
-
-            verify = bool(body.get("verify", True))
-            timeout_s = float(body.get("timeout_s") or 1.5)
-
-            pre_poll_payload: Optional[Dict[str, Any]] = None
-            pre_poll_result: Optional[Dict[str, Any]] = None
-            if not device_serial or not supplier or not device_type:
-                probe_dev = {
-                    "ip": ip,
-                    "port": port,
-                    "protocol": protocol,
-                    "path": path,
-                    "auth_type": auth_type,
-                    "auth_token": auth_token,
-                }
-                res = poll_device(probe_dev, timeout_s=timeout_s)
-                pre_poll_result = {
-                    "success": res.success,
-                    "http_status": res.http_status,
-                    "latency_ms": res.latency_ms,
-                    "error": res.error,
-                    "main_version": res.main_version,
-                }
-                if res.success and isinstance(res.payload, dict):
-                    pre_poll_payload = res.payload
-                    inferred = _infer_from_dvp(res.payload)
-                    if not supplier and inferred.get("supplier"):
-                        supplier = inferred["supplier"]
-                    if not device_type and inferred.get("device_type"):
-                        device_type = inferred["device_type"]
-                    if not device_serial and inferred.get("device_serial"):
-                        device_serial = device_key_prefix + inferred["device_serial"]
-
-            if not device_serial or not supplier or not device_type:
-                return _send_json(
-                    self,
-                    400,
-                    {
-                        "error": "missing_fields",
-                        "required": ["device_serial", "supplier", "device_type"],
-                        "hint": "provide dvp_url (or ip/port/path) and let server infer fields, or provide fields directly",
-                        "pre_poll": pre_poll_result,
-                    },
-                )
-
-            device_id, action = self.app.db.upsert_device_by_key(
-                cluster_id=int(cluster_id),
+            auth_obj = body.get("auth") or {"type": "none"}
+            auth_type = str(auth_obj.get("type") or "none").strip()
+            auth_token = auth_obj.get("token")
+            enabled = bool(body.get("enabled", True))
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 400, {"error": f"invalid_request:{e}"})
+        if not device_serial or not supplier or not device_type or not ip:
+            return _send_error(self, 400, "missing_fields")
+        try:
+            device_id = self.app.db.create_device(
+                cluster_id=cluster_id,
                 device_key=device_serial,
                 vendor=supplier,
                 model=device_type,
@@ -3200,535 +4188,593 @@ class VersionManagerHandler(BaseHTTPRequestHandler):
                 protocol=protocol,
                 path=path,
                 auth=DeviceAuth(type=auth_type, token=auth_token),
-                enabled=True,
+                enabled=enabled,
             )
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 409, {"error": f"create_device_failed:{e}"})
+        return _send_json(self, 201, {"id": device_id})
 
-            verification: Optional[Dict[str, Any]] = None
-            if verify:
-                if pre_poll_payload is not None and pre_poll_result is not None:
-                    self.app.db.record_snapshot(
-                        device_id=int(device_id),
-                        success=True,
-                        http_status=pre_poll_result.get("http_status"),
-                        latency_ms=pre_poll_result.get("latency_ms"),
-                        error=None,
-                        protocol_version=1,
-                        main_version=pre_poll_result.get("main_version"),
-                        firmware_version=None,
-                        payload=pre_poll_payload,
-                    )
-                    verification = pre_poll_result
-                else:
-                    dev = self.app.db.get_device(int(device_id))
-                    if dev:
-                        verification = self.app.poll_and_record(dev, timeout_s=timeout_s)
+    def _post_device_ack_controlled_files(self, parts: List[str]) -> None:
+        u = self._require_admin()
+        if not u:
+            return
+        try:
+            device_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_device_id")
+        if not self.app.db.get_device(device_id):
+            return _send_error(self, 404, "not_found")
 
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        requested_ack_id = body.get("ack_change_event_id")
+        if requested_ack_id is None:
+            requested_ack_id = body.get("change_event_id")
+        if requested_ack_id is None:
+            requested_ack_id = body.get("change_id")
+        try:
+            requested_ack_id_int = int(requested_ack_id) if requested_ack_id is not None else None
+        except Exception:
+            return _send_error(self, 400, "invalid_ack_change_event_id")
+
+        note = str(body.get("note") or body.get("reason") or "").strip()
+        if len(note) > 2000:
+            note = note[:2000]
+
+        reviewed_by = str(u.get("username") or "")
+        try:
+            ack_event_id, change_id = self.app.db.ack_controlled_files(
+                device_id=device_id, expected_change_id=requested_ack_id_int, reviewed_by=reviewed_by, note=note
+            )
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 500, {"error": f"ack_failed:{type(e).__name__}:{e}"})
+        if change_id is None:
+            return _send_error(self, 409, "no_controlled_files_change_event")
+        if ack_event_id is None:
             return _send_json(
                 self,
-                200,
-                {"device_id": device_id, "action": action, "ip": ip, "port": port, "path": path, "verification": verification},
+                409,
+                {
+                    "error": "stale_ack_change_event_id",
+                    "requested": requested_ack_id_int,
+                    "latest": change_id,
+                },
             )
+        self.app.events.publish({"event_id": ack_event_id, "event_type": "controlled_files_ack", "device_id": device_id})
+        return _send_json(
+            self,
+            200,
+            {"ok": True, "ack_change_event_id": change_id, "reviewed_by": reviewed_by},
+        )
 
-        if parts[:3] == ["api", "v1", "clusters"] and len(parts) == 3:
-            if not self._require_admin():
-                return
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            name = str(body.get("name") or "").strip()
-            if not name:
-                return _send_json(self, 400, {"error": "missing_name"})
-            description = body.get("description")
-            try:
-                cluster_id = self.app.db.create_cluster(name=name, description=description)
-            except Exception as e:  # noqa: BLE001
-                return _send_json(self, 409, {"error": f"create_cluster_failed:{e}"})
-            return _send_json(self, 201, {"id": cluster_id})
-
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 3:
-            if not self._require_admin():
-                return
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            try:
-                cluster_id = int(body.get("cluster_id"))
-                device_serial = _get_body_str(body, "device_serial").strip()
-                supplier = _get_body_str(body, "supplier").strip()
-                device_type = _get_body_str(body, "device_type").strip()
-                line_no = body.get("line_no")
-                ip = str(body.get("ip") or "").strip()
-                port = int(body.get("port") or 80)
-                protocol = str(body.get("protocol") or "dvp1-http").strip()
-                path = str(body.get("path") or "/.well-known/device-version").strip()
-                auth_obj = body.get("auth") or {"type": "none"}
-                auth_type = str(auth_obj.get("type") or "none").strip()
-                auth_token = auth_obj.get("token")
-                enabled = bool(body.get("enabled", True))
-            except Exception as e:  # noqa: BLE001
-                return _send_json(self, 400, {"error": f"invalid_request:{e}"})
-            if not device_serial or not supplier or not device_type or not ip:
-                return _send_json(self, 400, {"error": "missing_fields"})
-            try:
-                device_id = self.app.db.create_device(
-                    cluster_id=cluster_id,
-                    device_key=device_serial,
-                    vendor=supplier,
-                    model=device_type,
-                    line_no=str(line_no).strip() if line_no is not None else None,
-                    ip=ip,
-                    port=port,
-                    protocol=protocol,
-                    path=path,
-                    auth=DeviceAuth(type=auth_type, token=auth_token),
-                    enabled=enabled,
-                )
-            except Exception as e:  # noqa: BLE001
-                return _send_json(self, 409, {"error": f"create_device_failed:{e}"})
-            return _send_json(self, 201, {"id": device_id})
-
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 5 and parts[4] == "ack-controlled-files":
-            u = self._require_admin()
-            if not u:
-                return
-            try:
-                device_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_device_id"})
-            if not self.app.db.get_device(device_id):
-                return _send_json(self, 404, {"error": "not_found"})
-
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            requested_ack_id = body.get("ack_change_event_id")
-            if requested_ack_id is None:
-                requested_ack_id = body.get("change_event_id")
-            if requested_ack_id is None:
-                requested_ack_id = body.get("change_id")
-            try:
-                requested_ack_id_int = int(requested_ack_id) if requested_ack_id is not None else None
-            except Exception:
-                return _send_json(self, 400, {"error": "invalid_ack_change_event_id"})
+    def _post_baselines(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        try:
+            cluster_id = int(body.get("cluster_id"))
+            supplier = _get_body_str(body, "supplier").strip()
+            device_type = _get_body_str(body, "device_type").strip()
+            expected_main_version = str(body.get("expected_main_version") or "").strip()
+            allowed_main_globs = body.get("allowed_main_globs")
+            note = body.get("note")
+            effective_from = body.get("effective_from")
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 400, {"error": f"invalid_request:{e}"})
+        if not supplier or not device_type or not expected_main_version:
+            return _send_error(self, 400, "missing_fields")
+        self.app.db.upsert_baseline(
+            cluster_id=cluster_id,
+            vendor=supplier,
+            model=device_type,
+            expected_main_version=expected_main_version,
+            allowed_main_globs=allowed_main_globs if isinstance(allowed_main_globs, list) else None,
+            note=note,
+            effective_from=effective_from,
+        )
+        return _send_json(self, 201, {"ok": True})
 
-            note = str(body.get("note") or body.get("reason") or "").strip()
-            if len(note) > 2000:
-                note = note[:2000]
+    def _post_controlled_file_rules(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        try:
+            cluster_id = int(body.get("cluster_id"))
+            supplier = _get_body_str(body, "supplier").strip()
+            device_type = _get_body_str(body, "device_type").strip()
+            paths = body.get("paths")
+            mode = body.get("mode")
+            max_bytes = body.get("max_bytes")
+            note = body.get("note")
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 400, {"error": f"invalid_request:{e}"})
+        if not supplier or not device_type:
+            return _send_error(self, 400, "missing_fields")
+        if isinstance(paths, str):
+            paths = [x.strip() for x in paths.split(",") if x.strip()]
+        if not isinstance(paths, list):
+            paths = []
+        self.app.db.upsert_controlled_file_rule(
+            cluster_id=cluster_id,
+            vendor=supplier,
+            model=device_type,
+            paths=[str(x) for x in paths],
+            mode=str(mode) if mode is not None else None,
+            max_bytes=max_bytes,
+            note=note,
+        )
+        return _send_json(self, 201, {"ok": True})
 
-            change_id = None
-            try:
-                rows = self.app.db._query(  # type: ignore[attr-defined]
-                    """
-                    SELECT id
-                    FROM events
-                    WHERE device_id = ? AND event_type = 'controlled_files_change'
-                    ORDER BY created_at DESC, id DESC
-                    LIMIT 1
-                    """,
-                    (int(device_id),),
-                )
-                if rows:
-                    change_id = int(rows[0]["id"])
-            except Exception:
-                change_id = None
-            if change_id is None:
-                return _send_json(self, 409, {"error": "no_controlled_files_change_event"})
-            if requested_ack_id_int is not None and requested_ack_id_int != change_id:
-                return _send_json(
-                    self,
-                    409,
-                    {
-                        "error": "stale_ack_change_event_id",
-                        "requested": requested_ack_id_int,
-                        "latest": change_id,
-                    },
-                )
-            try:
-                self.app.db.create_event(
-                    device_id=device_id,
-                    event_type="controlled_files_ack",
-                    old_state=None,
-                    new_state=None,
-                    message="已确认受控文件变更",
-                    payload={
-                        "device_id": device_id,
-                        "ack_change_event_id": change_id,
-                        "reviewed_by": str(u.get("username") or ""),
-                        "review_note": note,
-                        "reviewed_at": _utc_now_iso(),
-                    },
-                )
-            except Exception:
-                pass
-            # Clear sticky indicator; status still uses snapshot/baseline priority.
-            try:
-                self.app.db.update_device_state(device_id, "ok")
-            except Exception:
-                pass
-            return _send_json(
-                self,
-                200,
-                {"ok": True, "ack_change_event_id": change_id, "reviewed_by": str(u.get("username") or "")},
-            )
+    def _post_version_catalog(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        try:
+            supplier = _get_body_str(body, "supplier").strip()
+            device_type = _get_body_str(body, "device_type").strip()
+            main_version = str(body.get("main_version") or "").strip()
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 400, {"error": f"invalid_request:{e}"})
+        if not supplier or not device_type or not main_version:
+            return _send_error(self, 400, "missing_fields")
+        self.app.db.upsert_version_catalog(
+            vendor=supplier,
+            model=device_type,
+            main_version=main_version,
+            changelog_md=body.get("changelog_md"),
+            released_at=body.get("released_at"),
+            risk_level=body.get("risk_level"),
+            checksum=body.get("checksum"),
+        )
+        self.app.invalidate_catalog_item(vendor=supplier, model=device_type, main_version=main_version)
+        return _send_json(self, 201, {"ok": True})
 
-        if parts[:3] == ["api", "v1", "baselines"] and len(parts) == 3:
-            if not self._require_admin():
-                return
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
+    def _post_poll(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
+        device_ids = body.get("device_ids")
+        timeout_s = float(body.get("timeout_s") or 2.0)
+        devices = self.app.db.list_devices(enabled_only=True)
+        if isinstance(device_ids, list):
+            allow = {int(x) for x in device_ids if isinstance(x, (int, str))}
+            devices = [d for d in devices if int(d["id"]) in allow]
+        started_at = _utc_now_iso()
+        results: List[Dict[str, Any]] = []
+        ex = self.app.request_executor("poll")
+        futures = {ex.submit(self.app.poll_and_record, d, timeout_s=timeout_s): d for d in devices}
+        for fut in _in_completion_order(futures):
             try:
-                cluster_id = int(body.get("cluster_id"))
-                supplier = _get_body_str(body, "supplier").strip()
-                device_type = _get_body_str(body, "device_type").strip()
-                expected_main_version = str(body.get("expected_main_version") or "").strip()
-                allowed_main_globs = body.get("allowed_main_globs")
-                note = body.get("note")
-                effective_from = body.get("effective_from")
+                results.append(fut.result())
             except Exception as e:  # noqa: BLE001
-                return _send_json(self, 400, {"error": f"invalid_request:{e}"})
-            if not supplier or not device_type or not expected_main_version:
-                return _send_json(self, 400, {"error": "missing_fields"})
-            self.app.db.upsert_baseline(
-                cluster_id=cluster_id,
-                vendor=supplier,
-                model=device_type,
-                expected_main_version=expected_main_version,
-                allowed_main_globs=allowed_main_globs if isinstance(allowed_main_globs, list) else None,
-                note=note,
-                effective_from=effective_from,
-            )
-            return _send_json(self, 201, {"ok": True})
+                dev = futures[fut]
+                results.append({"device_id": int(dev["id"]), "success": False, "error": f"poll_exception:{e}"})
+        ok = sum(1 for r in results if r.get("success"))
+        fail = len(results) - ok
+        return _send_json(
+            self,
+            200,
+            {"started_at": started_at, "finished_at": _utc_now_iso(), "ok": ok, "fail": fail, "results": results},
+        )
 
-        if parts[:3] == ["api", "v1", "controlled-file-rules"] and len(parts) == 3:
-            if not self._require_admin():
-                return
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            try:
-                cluster_id = int(body.get("cluster_id"))
-                supplier = _get_body_str(body, "supplier").strip()
-                device_type = _get_body_str(body, "device_type").strip()
-                paths = body.get("paths")
-                mode = body.get("mode")
-                max_bytes = body.get("max_bytes")
-                note = body.get("note")
-            except Exception as e:  # noqa: BLE001
-                return _send_json(self, 400, {"error": f"invalid_request:{e}"})
-            if not supplier or not device_type:
-                return _send_json(self, 400, {"error": "missing_fields"})
-            if isinstance(paths, str):
-                paths = [x.strip() for x in paths.split(",") if x.strip()]
-            if not isinstance(paths, list):
-                paths = []
-            self.app.db.upsert_controlled_file_rule(
-                cluster_id=cluster_id,
-                vendor=supplier,
-                model=device_type,
-                paths=[str(x) for x in paths],
-                mode=str(mode) if mode is not None else None,
-                max_bytes=max_bytes,
-                note=note,
-            )
-            return _send_json(self, 201, {"ok": True})
+    def _post_discover(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
 
-        if parts[:3] == ["api", "v1", "version-catalog"] and len(parts) == 3:
-            if not self._require_admin():
-                return
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
+        try:
+            cluster_id = int(body.get("cluster_id"))
+        except Exception:
+            return _send_error(self, 400, "missing_or_invalid_cluster_id")
+        if not self.app.db.get_cluster(cluster_id):
+            return _send_error(self, 404, "cluster_not_found")
+
+        cidr = body.get("cidr")
+        hosts = body.get("hosts")
+        port = int(body.get("port") or 80)
+        path = str(body.get("path") or "/.well-known/device-version")
+        protocol = str(body.get("protocol") or "dvp1-http")
+        timeout_s = float(body.get("timeout_s") or 0.8)
+        max_hosts = int(body.get("max_hosts") or 1024)
+        line_no = body.get("line_no")
+        auth_obj = body.get("auth") or {"type": "none"}
+        auth_type = str(auth_obj.get("type") or "none").strip()
+        auth_token = auth_obj.get("token")
+
+        targets: List[str] = []
+        if isinstance(hosts, list):
+            for h in hosts:
+                if isinstance(h, str) and h.strip():
+                    targets.append(h.strip())
+        elif isinstance(cidr, str) and cidr.strip():
             try:
-                supplier = _get_body_str(body, "supplier").strip()
-                device_type = _get_body_str(body, "device_type").strip()
-                main_version = str(body.get("main_version") or "").strip()
+                net = ipaddress.ip_network(cidr.strip(), strict=False)
             except Exception as e:  # noqa: BLE001
-                return _send_json(self, 400, {"error": f"invalid_request:{e}"})
-            if not supplier or not device_type or not main_version:
-                return _send_json(self, 400, {"error": "missing_fields"})
-            self.app.db.upsert_version_catalog(
-                vendor=supplier,
-                model=device_type,
-                main_version=main_version,
-                changelog_md=body.get("changelog_md"),
-                released_at=body.get("released_at"),
-                risk_level=body.get("risk_level"),
-                checksum=body.get("checksum"),
-            )
-            return _send_json(self, 201, {"ok": True})
-
-        if parts[:3] == ["api", "v1", "poll"] and len(parts) == 3:
-            if not self._require_admin():
+                return _send_json(self, 400, {"error": f"invalid_cidr:{e}"})
+            targets = _cidr_hosts(net, max_hosts)
+        else:
+            return _send_error(self, 400, "missing_cidr_or_hosts")
+
+        started_at = _utc_now_iso()
+        created = 0
+        updated = 0
+
+        # Everything but the address is the same for every target.
+        target = {"port": port, "protocol": protocol, "path": path, "auth_type": auth_type, "auth_token": auth_token}
+
+        def probe(ip: str) -> PollResult:
+            return poll_device({"ip": ip, **target}, timeout_s=timeout_s)
+
+        ex = self.app.request_executor("discover")
+        futures: Dict[Future, str] = {}
+        # Items are written as their probes complete instead of being collected and encoded at the
+        # end, so a large sweep starts answering right away and never holds every result at once.
+        # No Content-Length: the body ends when the connection closes.
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        pending = bytearray(b'{"started_at":%s,"targets":%d,"items":[' % (_json_bytes(started_at), len(targets)))
+        sent = 0
+        client_gone = False
+
+        def write(data: bytes) -> None:
+            nonlocal client_gone
+            if client_gone:
                 return
             try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-            device_ids = body.get("device_ids")
-            timeout_s = float(body.get("timeout_s") or 2.0)
-            devices = self.app.db.list_devices(enabled_only=True)
-            if isinstance(device_ids, list):
-                allow = {int(x) for x in device_ids if isinstance(x, (int, str))}
-                devices = [d for d in devices if int(d["id"]) in allow]
-            started_at = _utc_now_iso()
-            results: List[Dict[str, Any]] = []
-            with ThreadPoolExecutor(max_workers=self.app.poll_workers) as ex:
-                futures = {ex.submit(self.app.poll_and_record, d, timeout_s=timeout_s): d for d in devices}
-                for fut in as_completed(futures):
-                    try:
-                        results.append(fut.result())
-                    except Exception as e:  # noqa: BLE001
-                        dev = futures[fut]
-                        results.append({"device_id": int(dev["id"]), "success": False, "error": f"poll_exception:{e}"})
-            ok = sum(1 for r in results if r.get("success"))
-            fail = len(results) - ok
-            return _send_json(
-                self,
-                200,
-                {"started_at": started_at, "finished_at": _utc_now_iso(), "ok": ok, "fail": fail, "results": results},
-            )
-
-        if parts[:3] == ["api", "v1", "discover"] and len(parts) == 3:
-            if not self._require_admin():
+                self.wfile.write(data)
+            except OSError:
+                # The client went away. The sweep still runs to the end and stores every device
+                # it finds, as it did when the whole response was sent at once.
+                client_gone = True
+
+        def emit(item: Dict[str, Any]) -> None:
+            nonlocal sent
+            if client_gone:
                 return
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-
-            try:
-                cluster_id = int(body.get("cluster_id"))
-            except Exception:
-                return _send_json(self, 400, {"error": "missing_or_invalid_cluster_id"})
-            if not self.app.db.get_cluster(cluster_id):
-                return _send_json(self, 404, {"error": "cluster_not_found"})
+            data = _json_bytes(item)
+            if sent:
+                pending.extend(b",")
+            pending.extend(data)
+            sent += 1
+            if sent % 32 == 0:  # wfile is unbuffered: one send per batch rather than per item
+                write(pending)
+                pending.clear()
+
+        # (device kwargs, snapshot kwargs) of answering devices not yet written; stored 32 at a
+        # time in one transaction instead of two commits per device.
+        found: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+
+        def store_found() -> None:
+            nonlocal created, updated
+            if not found:
+                return
+            batch = list(found)
+            found.clear()
+            stored = self.app.db.record_discovered_devices(batch)
+            for (dev_id, action), (dev, snap) in zip(stored, batch):
+                if action == "created":
+                    created += 1
+                else:
+                    updated += 1
+                emit(
+                    {
+                        "ip": dev["ip"],
+                        "success": True,
+                        "device_id": dev_id,
+                        "device_serial": dev["device_key"],
+                        "supplier": dev["vendor"],
+                        "device_type": dev["model"],
+                        "main_version": snap["main_version"],
+                        "action": action,
+                    }
+                )
 
-            cidr = body.get("cidr")
-            hosts = body.get("hosts")
-            port = int(body.get("port") or 80)
-            path = str(body.get("path") or "/.well-known/device-version")
-            protocol = str(body.get("protocol") or "dvp1-http")
-            timeout_s = float(body.get("timeout_s") or 0.8)
-            max_hosts = int(body.get("max_hosts") or 1024)
-            line_no = body.get("line_no")
-            auth_obj = body.get("auth") or {"type": "none"}
-            auth_type = str(auth_obj.get("type") or "none").strip()
-            auth_token = auth_obj.get("token")
+        try:
+            # IP literals get a TCP connect sweep first, 256 at a time, so addresses where nothing
+            # listens fail together in one timeout instead of holding a probe worker each.
+            # Hostnames go straight to the HTTP probe.
+            literals: List[str] = []
+            for ip in targets:
+                try:
+                    ipaddress.ip_address(ip)
+                except ValueError:
+                    futures[ex.submit(probe, ip)] = ip
+                else:
+                    literals.append(ip)
+            for i in range(0, len(literals), 256):
+                chunk = literals[i : i + 256]
+                alive = tcp_reachable(chunk, port, timeout_s)
+                for ip in chunk:
+                    if ip in alive:
+                        futures[ex.submit(probe, ip)] = ip
+                    else:
+                        emit({"ip": ip, "success": False, "error": "tcp_refused_or_timeout"})
 
-            targets: List[str] = []
-            if isinstance(hosts, list):
-                for h in hosts:
-                    if isinstance(h, str) and h.strip():
-                        targets.append(h.strip())
-            elif isinstance(cidr, str) and cidr.strip():
+            for fut in _in_completion_order(futures):
+                ip = futures[fut]
                 try:
-                    net = ipaddress.ip_network(cidr.strip(), strict=False)
+                    res = fut.result()
                 except Exception as e:  # noqa: BLE001
-                    return _send_json(self, 400, {"error": f"invalid_cidr:{e}"})
-                for i, ip in enumerate(net.hosts()):
-                    if i >= max_hosts:
-                        break
-                    targets.append(str(ip))
-            else:
-                return _send_json(self, 400, {"error": "missing_cidr_or_hosts"})
-
-            started_at = _utc_now_iso()
-            discovered: List[Dict[str, Any]] = []
-            created = 0
-            updated = 0
-
-            def probe(ip: str) -> Tuple[str, Dict[str, Any]]:
-                dev = {
-                    "ip": ip,
-                    "port": port,
-                    "protocol": protocol,
-                    "path": path,
-                    "auth_type": auth_type,
-                    "auth_token": auth_token,
-                }
-                res = poll_device(dev, timeout_s=timeout_s)
-                return ip, {"poll": res}
-
-            with ThreadPoolExecutor(max_workers=min(self.app.poll_workers, 32)) as ex:
-                futures = {ex.submit(probe, ip): ip for ip in targets}
-                for fut in as_completed(futures):
-                    ip = futures[fut]
-                    try:
-                        ip2, out = fut.result()
-                        res = out["poll"]
-                    except Exception as e:  # noqa: BLE001
-                        discovered.append({"ip": ip, "success": False, "error": f"probe_exception:{e}"})
-                        continue
-
-                    if not res.success or not isinstance(res.payload, dict):
-                        discovered.append({"ip": ip2, "success": False, "error": res.error})
-                        continue
-
-                    payload = res.payload
-                    inferred = _infer_from_dvp(payload)
-                    supplier = str(inferred.get("supplier") or "").strip()
-                    device_type = str(inferred.get("device_type") or "").strip()
-                    device_id = str(inferred.get("device_serial") or "").strip()
-                    if not supplier or not device_type or not device_id:
-                        discovered.append({"ip": ip2, "success": False, "error": "missing_device_fields"})
-                        continue
-
-                    device_serial = str(body.get("device_key_prefix") or "").strip() + device_id
-                    dev_id, action = self.app.db.upsert_device_by_key(
-                        cluster_id=cluster_id,
-                        device_key=device_serial,
-                        vendor=supplier,
-                        model=device_type,
-                        line_no=str(line_no).strip() if line_no is not None else None,
-                        ip=ip2,
-                        port=port,
-                        protocol=protocol,
-                        path=path,
-                        auth=DeviceAuth(type=auth_type, token=auth_token),
-                        enabled=True,
-                    )
-                    if action == "created":
-                        created += 1
-                    else:
-                        updated += 1
-
-                    self.app.db.record_snapshot(
-                        device_id=dev_id,
-                        success=True,
-                        http_status=res.http_status,
-                        latency_ms=res.latency_ms,
-                        error=None,
-                        protocol_version=res.protocol_version,
-                        main_version=res.main_version,
-                        firmware_version=res.firmware_version,
-                        payload=res.payload,
-                    )
-                    discovered.append(
+                    emit({"ip": ip, "success": False, "error": f"probe_exception:{e}"})
+                    continue
+
+                if not res.success or not isinstance(res.payload, dict):
+                    emit({"ip": ip, "success": False, "error": res.error})
+                    continue
+
+                payload = res.payload
+                inferred = _infer_from_dvp(payload)
+                supplier = str(inferred.get("supplier") or "").strip()
+                device_type = str(inferred.get("device_type") or "").strip()
+                device_id = str(inferred.get("device_serial") or "").strip()
+                if not supplier or not device_type or not device_id:
+                    emit({"ip": ip, "success": False, "error": "missing_device_fields"})
+                    continue
+
+                device_serial = str(body.get("device_key_prefix") or "").strip() + device_id
+                found.append(
+                    (
+                        {
+                            "cluster_id": cluster_id,
+                            "device_key": device_serial,
+                            "vendor": supplier,
+                            "model": device_type,
+                            "line_no": str(line_no).strip() if line_no is not None else None,
+                            "ip": ip,
+                            "port": port,
+                            "protocol": protocol,
+                            "path": path,
+                            "auth": DeviceAuth(type=auth_type, token=auth_token),
+                            "enabled": True,
+                        },
                         {
-                            "ip": ip2,
                             "success": True,
-                            "device_id": dev_id,
-                            "device_serial": device_serial,
-                            "supplier": supplier,
-                            "device_type": device_type,
+                            "http_status": res.http_status,
+                            "latency_ms": res.latency_ms,
+                            "error": None,
+                            "protocol_version": res.protocol_version,
                             "main_version": res.main_version,
-                            "action": action,
-                        }
+                            "firmware_version": res.firmware_version,
+                            "payload": res.payload,
+                        },
                     )
+                )
+                if len(found) >= 32:
+                    store_found()
 
-            return _send_json(
-                self,
-                200,
-                {
-                    "started_at": started_at,
-                    "finished_at": _utc_now_iso(),
-                    "targets": len(targets),
-                    "created": created,
-                    "updated": updated,
-                    "items": discovered,
-                },
+            store_found()
+            pending.extend(
+                b'],"finished_at":%s,"created":%d,"updated":%d}'
+                % (_json_bytes(_utc_now_iso()), created, updated)
             )
+        except Exception as e:  # noqa: BLE001
+            # The 200 status is already out: end the body with an error record so the client can
+            # tell a failed sweep from a finished one.
+            for fut in futures:
+                fut.cancel()
+            pending.extend(b'],"error":%s}' % _json_bytes(f"discover_failed:{e}"))
+        write(pending)
+        return
 
-        return _send_json(self, 404, {"error": "not_found"})
+    # Keyed like _GET_ROUTES: (resource, segment count, sub-resource).
+    _POST_ROUTES: Dict[Tuple[str, int, Optional[str]], Callable[..., None]] = {
+        ("setup", 3, None): _post_setup,
+        ("login", 3, None): _post_login,
+        ("logout", 3, None): _post_logout,
+        ("analyze", 4, None): _post_analyze_device,
+        ("register", 3, None): _post_register,
+        ("clusters", 3, None): _post_clusters,
+        ("devices", 3, None): _post_devices,
+        ("devices", 5, "ack-controlled-files"): _post_device_ack_controlled_files,
+        ("baselines", 3, None): _post_baselines,
+        ("controlled-file-rules", 3, None): _post_controlled_file_rules,
+        ("version-catalog", 3, None): _post_version_catalog,
+        ("poll", 3, None): _post_poll,
+        ("discover", 3, None): _post_discover,
+    }
 
-    def do_PUT(self) -> None:  # noqa: N802
-        parsed = urlparse(self.path)
-        parts = _path_parts(parsed.path)
+    def do_POST(self) -> None:  # noqa: N802
+        self._dispatch(self._POST_ROUTES)
+
+    def _dispatch(self, routes: Dict[Tuple[str, int, Optional[str]], Callable[..., None]]) -> None:
+        self._body_read = False
+        parts = _path_parts(urlparse(self.path).path)
+        route = None
+        if len(parts) >= 3 and parts[0] == "api" and parts[1] == "v1":
+            route = routes.get((parts[2], len(parts), parts[4] if len(parts) > 4 else None))
+        if route is not None:
+            route(self, parts)
+        else:
+            _send_error(self, 404, "not_found")
+        self._discard_unread_body()
 
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 4:
-            if not self._require_admin():
-                return
-            try:
-                device_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_device_id"})
-            if not self.app.db.get_device(device_id):
-                return _send_json(self, 404, {"error": "not_found"})
-            try:
-                body = _read_json(self)
-            except ValueError as e:
-                return _send_json(self, 400, {"error": str(e)})
-
-            auth = None
-            if "auth" in body:
-                auth_obj = body.get("auth") or {"type": "none"}
-                auth = DeviceAuth(type=str(auth_obj.get("type") or "none"), token=auth_obj.get("token"))
-
-            cluster_id = body.get("cluster_id")
-            port = body.get("port")
-            enabled = body.get("enabled")
-            line_no = body.get("line_no")
-            try:
-                cluster_id = int(cluster_id) if cluster_id is not None else None
-                port = int(port) if port is not None else None
-                enabled = bool(enabled) if enabled is not None else None
-            except Exception as e:  # noqa: BLE001
-                return _send_json(self, 400, {"error": f"invalid_request:{e}"})
+    def _discard_unread_body(self) -> None:
+        """On a kept-alive connection, a body the handler never read would be parsed as the next request."""
+        if self.headers.get("Transfer-Encoding"):
+            self.close_connection = True  # chunked bodies are not parsed here
+            return
+        if self._body_read:
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length == 0:
+            return
+        if 0 < length <= 65536:
+            self.rfile.read(length)
+        else:
+            self.close_connection = True
 
-            self.app.db.update_device(
-                device_id,
-                cluster_id=cluster_id,
-                device_key=body.get("device_serial"),
-                vendor=body.get("supplier"),
-                model=body.get("device_type"),
-                line_no=str(line_no).strip() if line_no is not None else None,
-                ip=body.get("ip"),
-                port=port,
-                protocol=body.get("protocol"),
-                path=body.get("path"),
-                auth=auth,
-                enabled=enabled,
-            )
-            return _send_json(self, 200, {"ok": True})
+    def _put_device(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            device_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_device_id")
+        if not self.app.db.get_device(device_id):
+            return _send_error(self, 404, "not_found")
+        try:
+            body = _read_json(self)
+        except ValueError as e:
+            return _send_error(self, 400, str(e))
 
-        return _send_json(self, 404, {"error": "not_found"})
+        auth = None
+        if "auth" in body:
+            auth_obj = body.get("auth") or {"type": "none"}
+            auth = DeviceAuth(type=str(auth_obj.get("type") or "none"), token=auth_obj.get("token"))
+
+        cluster_id = body.get("cluster_id")
+        port = body.get("port")
+        enabled = body.get("enabled")
+        line_no = body.get("line_no")
+        try:
+            cluster_id = int(cluster_id) if cluster_id is not None else None
+            port = int(port) if port is not None else None
+            enabled = bool(enabled) if enabled is not None else None
+        except Exception as e:  # noqa: BLE001
+            return _send_json(self, 400, {"error": f"invalid_request:{e}"})
+
+        self.app.db.update_device(
+            device_id,
+            cluster_id=cluster_id,
+            device_key=body.get("device_serial"),
+            vendor=body.get("supplier"),
+            model=body.get("device_type"),
+            line_no=str(line_no).strip() if line_no is not None else None,
+            ip=body.get("ip"),
+            port=port,
+            protocol=body.get("protocol"),
+            path=body.get("path"),
+            auth=auth,
+            enabled=enabled,
+        )
+        self.app.forget_device(device_id)
+        return _send_json(self, 200, {"ok": True})
+
+    _PUT_ROUTES: Dict[Tuple[str, int, Optional[str]], Callable[..., None]] = {
+        ("devices", 4, None): _put_device,
+    }
+
+    def do_PUT(self) -> None:  # noqa: N802
+        self._dispatch(self._PUT_ROUTES)
+
+    def _delete_baseline(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            baseline_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_baseline_id")
+        if not self.app.db.delete_baseline(baseline_id):
+            return _send_error(self, 404, "not_found")
+        return _send_json(self, 200, {"ok": True})
+
+    def _delete_controlled_file_rule(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            rule_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_rule_id")
+        if not self.app.db.delete_controlled_file_rule(rule_id):
+            return _send_error(self, 404, "not_found")
+        return _send_json(self, 200, {"ok": True})
+
+    def _delete_device(self, parts: List[str]) -> None:
+        if not self._require_admin():
+            return
+        try:
+            device_id = int(parts[3])
+        except ValueError:
+            return _send_error(self, 400, "invalid_device_id")
+        if not self.app.db.get_device(device_id):
+            return _send_error(self, 404, "not_found")
+        self.app.db.delete_device(device_id)
+        self.app.forget_device(device_id)
+        return _send_json(self, 200, {"ok": True})
+
+    _DELETE_ROUTES: Dict[Tuple[str, int, Optional[str]], Callable[..., None]] = {
+        ("baselines", 4, None): _delete_baseline,
+        ("controlled-file-rules", 4, None): _delete_controlled_file_rule,
+        ("devices", 4, None): _delete_device,
+    }
 
     def do_DELETE(self) -> None:  # noqa: N802
-        parsed = urlparse(self.path)
-        parts = _path_parts(parsed.path)
+        self._dispatch(self._DELETE_ROUTES)
 
-        if parts[:3] == ["api", "v1", "baselines"] and len(parts) == 4:
-            if not self._require_admin():
-                return
-            try:
-                baseline_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_baseline_id"})
-            if not self.app.db.delete_baseline(baseline_id):
-                return _send_json(self, 404, {"error": "not_found"})
-            return _send_json(self, 200, {"ok": True})
+class _PooledHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that hands connections to long-lived worker threads.
 
-        if parts[:3] == ["api", "v1", "controlled-file-rules"] and len(parts) == 4:
-            if not self._require_admin():
-                return
-            try:
-                rule_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_rule_id"})
-            if not self.app.db.delete_controlled_file_rule(rule_id):
-                return _send_json(self, 404, {"error": "not_found"})
-            return _send_json(self, 200, {"ok": True})
+    Up to `workers` threads are started on demand and then kept, so steady traffic no longer
+    costs a thread start per connection. When every worker is busy (event streams hold one for
+    as long as the page is open) the connection gets its own thread as before rather than
+    waiting behind them.
+    """
 
-        if parts[:3] == ["api", "v1", "devices"] and len(parts) == 4:
-            if not self._require_admin():
+    def __init__(
+        self, server_address: Tuple[str, int], handler_class: Any, *, workers: int = 32, reuse_port: bool = False
+    ):
+        # SO_REUSEPORT (where the OS has it) lets several instances share the port; the kernel spreads connections.
+        self.allow_reuse_port = reuse_port
+        super().__init__(server_address, handler_class)
+        self._max_workers = max(1, int(workers))
+        self._started_workers = 0
+        self._idle_workers = 0
+        self._pool_lock = threading.Lock()
+        self._pending: "queue.SimpleQueue[Optional[Tuple[Any, Any]]]" = queue.SimpleQueue()
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        with self._pool_lock:
+            if self._idle_workers > 0:
+                self._idle_workers -= 1
+                self._pending.put((request, client_address))
                 return
-            try:
-                device_id = int(parts[3])
-            except ValueError:
-                return _send_json(self, 400, {"error": "invalid_device_id"})
-            if not self.app.db.get_device(device_id):
-                return _send_json(self, 404, {"error": "not_found"})
-            self.app.db.delete_device(device_id)
-            return _send_json(self, 200, {"ok": True})
+            start_worker = self._started_workers < self._max_workers
+            if start_worker:
+                self._started_workers += 1
+        if start_worker:
+            threading.Thread(
+                target=self._worker, args=((request, client_address),), name="vm-http", daemon=True
+            ).start()
+            return
+        super().process_request(request, client_address)
+
+    def _worker(self, item: Optional[Tuple[Any, Any]]) -> None:
+        while item is not None:
+            self.process_request_thread(*item)
+            with self._pool_lock:
+                self._idle_workers += 1
+            item = self._pending.get()
 
-        return _send_json(self, 404, {"error": "not_found"})
+    def server_close(self) -> None:
+        super().server_close()
+        with self._pool_lock:
+            started = self._started_workers
+        for _ in range(started):
+            self._pending.put(None)
 
 
 def serve(
@@ -3744,6 +4790,9 @@ def serve(
     webhook_url: Optional[str] = None,
     api_token: Optional[str] = None,
     frontend_dist: Optional[str] = None,
+    max_poll_interval_s: float = 0.0,
+    http_workers: int = 32,
+    reuse_port: bool = False,
 ) -> None:
     db = Database(db_path)
     if default_cluster_name and default_cluster_id is None:
@@ -3763,8 +4812,9 @@ def serve(
         webhook_url=webhook_url,
         api_token=api_token,
         frontend_dist=frontend_dist,
+        max_poll_interval_s=max_poll_interval_s,
     )
-    httpd = ThreadingHTTPServer((host, port), VersionManagerHandler)
+    httpd = _PooledHTTPServer((host, port), VersionManagerHandler, workers=http_workers, reuse_port=reuse_port)
     httpd.app = app  # type: ignore[attr-defined]
     print(
         json.dumps(
@@ -3776,6 +4826,7 @@ def serve(
                 "registration_token_enabled": bool(registration_token),
                 "default_cluster_id": default_cluster_id,
                 "poll_interval_s": poll_interval_s,
+                "max_poll_interval_s": max_poll_interval_s,
                     "webhook_url": webhook_url,
                     "api_token_enabled": bool(api_token),
                     "frontend_dist": os.path.abspath(frontend_dist) if frontend_dist else None,
@@ -3798,6 +4849,12 @@ def main() -> None:
     p.add_argument("--port", default=8080, type=int)
     p.add_argument("--db", dest="db_path", default=os.path.join("data", "vm.sqlite3"))
     p.add_argument("--poll-workers", default=10, type=int)
+    p.add_argument("--http-workers", default=32, type=int, help="HTTP worker threads kept alive between requests")
+    p.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="Set SO_REUSEPORT so several instances (same --db, only one with --poll-interval) can share the port",
+    )
     p.add_argument("--registration-token", default=None, help="Optional token required by /api/v1/register")
     p.add_argument(
         "--default-cluster-id",
@@ -3811,6 +4868,12 @@ def main() -> None:
         help="Auto-create/use cluster by name; used by /api/v1/register when cluster is omitted",
     )
     p.add_argument("--poll-interval", default=0, type=float, help="Auto poll interval seconds (0 disables)")
+    p.add_argument(
+        "--max-poll-interval",
+        default=0,
+        type=float,
+        help="Back off unchanged devices up to this many seconds between auto polls (0 disables)",
+    )
     p.add_argument("--webhook-url", default=None, help="POST events to webhook URL (optional)")
     p.add_argument("--api-token", default=None, help="Optional admin API token via X-Api-Token header")
     p.add_argument("--frontend-dist", default=os.path.join("web", "dist"), help="Optional built frontend dist directory")
@@ -3827,6 +4890,9 @@ def main() -> None:
         webhook_url=args.webhook_url,
         api_token=args.api_token,
         frontend_dist=args.frontend_dist,
+        max_poll_interval_s=args.max_poll_interval,
+        http_workers=args.http_workers,
+        reuse_port=args.reuse_port,
     )
 
 
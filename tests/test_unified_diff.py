@@ -0,0 +1,102 @@
+import difflib
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from src.version_manager.server import _unified_diff
+
+_HUNK_RE = re.compile(r"@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+
+
+def _edit(rnd: random.Random, a: list, pool: list) -> list:
+    b = list(a)
+    for _ in range(rnd.randint(1, 4)):
+        op = rnd.random()
+        k = rnd.randint(0, len(b))
+        if op < 0.4 or not b:
+            b.insert(k, rnd.choice(pool))
+        elif op < 0.7:
+            del b[min(k, len(b) - 1)]
+        else:
+            b[min(k, len(b) - 1)] = rnd.choice(pool)
+    return b
+
+
+def _hunks(diff: str) -> list:
+    """(old start, old length, body lines) of every hunk."""
+    out = []
+    for line in diff.splitlines(True)[2:]:
+        m = _HUNK_RE.match(line)
+        if m:
+            out.append((int(m.group(1)), int(m.group(2) or 1), []))
+        else:
+            out[-1][2].append(line)
+    return out
+
+
+class UnifiedDiffTest(unittest.TestCase):
+    def test_matches_difflib_on_distinct_lines(self):
+        rnd = random.Random(1)
+        pool = [f"line {i}\n" for i in range(10_000)]
+        for _ in range(500):
+            a = [rnd.choice(pool) for _ in range(rnd.randint(0, 80))]
+            b = _edit(rnd, a, pool)
+            self.assertEqual(
+                _unified_diff(a, b, fromfile="a", tofile="b"),
+                "".join(difflib.unified_diff(a, b, fromfile="a", tofile="b")),
+            )
+
+    def test_blank_line_next_to_blank_run_keeps_full_context(self):
+        a = [f"k{i} = {i}\n" for i in range(10)] + ["\n", "\n"] + [f"v{i} = {i}\n" for i in range(10)]
+        b = a[:11] + ["\n"] + a[11:]
+        diff = _unified_diff(a, b, fromfile="a", tofile="b")
+        (start, length, body), = _hunks(diff)
+        self.assertEqual((start, length), (10, 6))
+        self.assertEqual(sum(1 for line in body if line.startswith("+")), 1)
+
+    def test_hunks_have_n_context_lines_on_repetitive_input(self):
+        rnd = random.Random(2)
+        pool = ["\n", "\n", "}\n", "x = 1\n", "[section]\n", "a\n"]
+        for _ in range(500):
+            a = [rnd.choice(pool) for _ in range(rnd.randint(0, 60))]
+            b = _edit(rnd, a, pool)
+            for start, length, body in _hunks(_unified_diff(a, b, fromfile="a", tofile="b")):
+                lead = next(i for i, line in enumerate(body) if line[0] != " ")
+                trail = next(i for i, line in enumerate(reversed(body)) if line[0] != " ")
+                # old lines [first, end) are covered; an empty range "N,0" sits after line N
+                first = start - 1 if length else start
+                if first > 0:
+                    self.assertEqual(lead, 3)
+                if first + length < len(a):
+                    self.assertEqual(trail, 3)
+
+    @unittest.skipUnless(shutil.which("patch"), "patch(1) not installed")
+    def test_patch_applies_strictly(self):
+        rnd = random.Random(3)
+        pool = ["\n", "\n", "}\n", "x = 1\n", "[section]\n", "a\n"]
+        tmp = tempfile.mkdtemp()
+        try:
+            src, patch_file, out = (os.path.join(tmp, n) for n in ("src", "diff", "out"))
+            for _ in range(200):
+                a = [rnd.choice(pool) for _ in range(rnd.randint(1, 60))]
+                b = _edit(rnd, a, pool)
+                diff = _unified_diff(a, b, fromfile="a", tofile="b")
+                if not diff:
+                    continue
+                with open(src, "w") as f:
+                    f.write("".join(a))
+                with open(patch_file, "w") as f:
+                    f.write(diff)
+                subprocess.run(["patch", "-s", "-F0", "-o", out, src, patch_file], check=True)
+                with open(out) as f:
+                    self.assertEqual(f.read(), "".join(b))
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,22 @@
+// path -> ETag and body of the last GET that carried one; replayed as If-None-Match so an
+// unchanged list (status, clusters, ...) comes back as an empty 304.
+const getCache = new Map<string, { etag: string; body: string }>();
+
 export async function apiFetch(path: string, init?: RequestInit): Promise<Response> {
-  const res = await fetch(path, { ...init, credentials: "include" });
+  const isGet = !init?.method || init.method.toUpperCase() === "GET";
+  const cached = isGet ? getCache.get(path) : undefined;
+  const headers = new Headers(init?.headers);
+  if (cached) headers.set("If-None-Match", cached.etag);
+  const res = await fetch(path, { ...init, headers, credentials: "include" });
   if (res.status === 401) {
     window.location.href = "/login";
     throw new Error("unauthorized");
   }
+  if (cached && res.status === 304) {
+    return new Response(cached.body, { status: 200, headers: { "Content-Type": "application/json; charset=utf-8" } });
+  }
+  const etag = isGet && res.ok ? res.headers.get("ETag") : null;
+  if (etag) getCache.set(path, { etag, body: await res.clone().text() });
   return res;
 }
 